@@ -3,11 +3,11 @@ import sys
 from scipy import stats
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.mlab as ml
 import pandas as pd
 from scipy import ndimage
 
 import util
+import gridding
 
 
 def get_density_xyz(density_xyz_file):
@@ -48,7 +48,7 @@ def grid_log_density(xx,yy,zz):
 	yi = np.linspace(min(yy), max(yy))
 	X, Y = np.meshgrid(xi, yi)
 	zz_log = np.log(zz)
-	Z_log = ml.griddata(xx, yy, zz_log, xi, yi, interp='linear')
+	Z_log = gridding.griddata_linear(xx, yy, zz_log, xi, yi)
 	
 	return Z_log
 
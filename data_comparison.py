@@ -1,15 +1,48 @@
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-##from ~github/roll_your_own_py/src/geospatial
-import nearest_neighbour
+from scipy.spatial import cKDTree
 ##from ~github/python_functions
 import data_comparison
+import spatial_order
+import point_index_cache
+import dem_point_operations
+from geotransform import Affine
 import georaster
 import raster_functions
 import util
 
-def point_differences(data_1, data_2, search_dist=100, output_csv='', plot=True, plot_title='', fig_outpath='', verbose=True):
+def nearest_neighbours(data_1, data_2, search_dist=100, workers=-1, order='morton'):
+	"""
+	Finds the nearest data_1 point to each data_2 point with a KD-tree (scipy cKDTree), 
+	querying on all cores (workers=-1). By default the data_2 points are queried in Morton 
+	order (see spatial_order.py) so consecutive queries walk the same parts of the tree - 
+	over twice as fast for points in random/acquisition order. Set order=None to query 
+	in the order given.
+
+	VARIABLES
+
+	data_1, data_2 	= dataframes with x and y columns (or n x 2 arrays)
+	search_dist 	= neighbours further away than this are ignored
+
+	RETURN
+
+	distances (inf where there is no neighbour within search_dist), indices into data_1 
+	(len(data_1) where there is no neighbour) - both the same length as data_2
+	"""
+	xy_1 = data_1[['x', 'y']].values if isinstance(data_1, pd.DataFrame) else np.asarray(data_1)
+	xy_2 = data_2[['x', 'y']].values if isinstance(data_2, pd.DataFrame) else np.asarray(data_2)
+
+	tree = cKDTree(xy_1)
+	if order is None:
+		return tree.query(xy_2, k=1, distance_upper_bound=search_dist, workers=workers)
+
+	perm = spatial_order.spatial_order(xy_2[:, 0], xy_2[:, 1], curve=order)
+	dists, indxs = tree.query(xy_2[perm], k=1, distance_upper_bound=search_dist, workers=workers)
+	return spatial_order.scatter_back(dists, perm), spatial_order.scatter_back(indxs, perm)
+
+def point_differences(data_1, data_2, search_dist=100, output_csv='', plot=True, plot_title='', fig_outpath='', verbose=True, workers=-1, index_cache=None):
 	"""
 	Takes in two datasets of points and calculates the differences between them. 
 	Nearest neighbours from data set 1 to data set 2 are found and then subtracted to assess agreement.
@@ -18,7 +51,8 @@ def point_differences(data_1, data_2, search_dist=100, output_csv='', plot=True,
 	VARIABLES
 	
 	data_1 			= points which will be used to compare to data_2, from which neighbours 
-					  will be sought - expects column headers to be x, y and z
+					  will be sought - expects column headers to be x, y and z. Can also be 
+					  the path of a csv of these points (needed to use index_cache)
 	data_2 			= dataset which will be used to associated neighbours too (i.e. 
 					  the maximum comparisons you can have will be equal to the length 
 					  of this dataset, assuming they are within the tolerance set by 
@@ -29,6 +63,10 @@ def point_differences(data_1, data_2, search_dist=100, output_csv='', plot=True,
 	plot 			= if True, displays a quick overview plot of the differences (default = True)
 	plot_title 		= title of overview plot - only used if plot is True
 	verbose 		= print out sanity check messages (default=True)
+	workers 		= number of threads for the neighbour search (default -1 = all cores)
+	index_cache 	= a point_index_cache.PointIndexCache (or a cache directory) - if data_1 is 
+					  a path, its spatial index is kept here and reused by later calls 
+					  rather than rebuilt each time
 
 	RETURN 
 
@@ -38,51 +76,52 @@ def point_differences(data_1, data_2, search_dist=100, output_csv='', plot=True,
 	@date	: 26th April 2016
 	"""
 	
+	if isinstance(data_1, str) and index_cache is None:
+		data_1 = pd.read_csv(data_1)
+
 	print("\nCalculating nearest neighbours...")
-	dists_nn, indxs_nn = nearest_neighbour.get_nn(data_1, data_2, nn=1, radius=search_dist) # outputs are same length as data_2, index values in indxs_nn are of the data_1 dataset
+	if isinstance(data_1, str):
+		if not isinstance(index_cache, point_index_cache.PointIndexCache):
+			index_cache = point_index_cache.PointIndexCache(index_cache)
+		index = index_cache.get(data_1, cell_size=search_dist)
+		dists_nn, indxs_nn = index.query(data_2['x'].values, data_2['y'].values, search_dist) # indxs_nn are positions in the index arrays
+		ref_x, ref_y, ref_z = index.x, index.y, index.z
+	else:
+		dists_nn, indxs_nn = nearest_neighbours(data_1, data_2, search_dist, workers=workers) # outputs are same length as data_2, index values in indxs_nn are of the data_1 dataset
+		ref_x, ref_y, ref_z = data_1['x'].values, data_1['y'].values, data_1['z'].values
 
-	#keep only observations that are within the "search_dist" of a gridded point
-	infinity=float("inf")
-	indx_of_observations_wth_no_nn = (dists_nn == infinity).nonzero() # see here: http://docs.scipy.org/doc/numpy-1.10.1/reference/generated/numpy.nonzero.html
+	#keep only observations that are within the "search_dist" of a data_1 point
+	has_nn = np.isfinite(dists_nn)
+	n_no_nn = len(data_2) - np.count_nonzero(has_nn)
 
 	if verbose: print("Total (data_2) observations within extent: %f" %(len(data_2)))
-	if verbose: print("\nNumber of observations (data_2) with no nn from data_1: %i" %(len(indx_of_observations_wth_no_nn[0])))
+	if verbose: print("\nNumber of observations (data_2) with no nn from data_1: %i" %(n_no_nn))
 	if verbose: print("Only considering observations with neighbours from data_1 within the set search distance of %i units" %(search_dist))
-	if verbose: print("Observations (data_2) to ignore: %f" %(len(indx_of_observations_wth_no_nn[0])))
-	if verbose: print("Observations (data_2) to remain: %f" %(len(data_2)-len(indx_of_observations_wth_no_nn[0])))
-
-	if verbose: print("\nBefore removal of (data_2) points with no nn...")
-	if verbose: print(len(data_2))
-
-	points_after_drop = data_2.drop(data_2.index[list(indx_of_observations_wth_no_nn[0])])
-	points_after_drop=points_after_drop.reset_index() # reset the index (so index matches row number)
-	points_after_drop=points_after_drop.drop(points_after_drop.columns[0], axis=1) # remove first column which wil be the inidices
+	if verbose: print("Observations (data_2) to ignore: %f" %(n_no_nn))
+	if verbose: print("Observations (data_2) to remain: %f" %(len(data_2)-n_no_nn))
 
-	if verbose: print("\nAfter removal of (data_2) points with no nn...")
-	if verbose: print(len(points_after_drop))
+	indxs_nn = indxs_nn[has_nn]
 
-	assert (len(data_2)-len(indx_of_observations_wth_no_nn[0])) == len(points_after_drop)
+	# get x, y and z value of nn
+	x_nn = ref_x[indxs_nn]
+	y_nn = ref_y[indxs_nn]
+	z_nn = ref_z[indxs_nn]
 
-	#remove any items in dists_nn and indxs_nn where dists_nn==Inf
-	if verbose: print("\nBefore removal of points with no nn...")
-	if verbose: print(len(indxs_nn))
-	if verbose: print(len(dists_nn))
-	indxs_nn=indxs_nn[dists_nn!=infinity]
-	dists_nn=dists_nn[dists_nn!=infinity]
-	if verbose: print("\nAfter removal of points with no nn...")
-	if verbose: print(len(indxs_nn))
-	if verbose: print(len(dists_nn))
+	#calculate differences
+	diffs = data_2['z'].values[has_nn] - z_nn
+	
+	return difference_output(data_2, has_nn, x_nn, y_nn, z_nn, diffs, output_csv, plot, plot_title, fig_outpath)
 
-	assert len(dists_nn) == len(points_after_drop)
+def difference_output(data_2, keep, x_ref, y_ref, z_ref, diffs, output_csv='', plot=True, plot_title='', fig_outpath=''):
+	"""
+	Builds the difference dataframe (the kept data_2 rows plus the data2_x|data2_y|data2_z 
+	reference values and DIFF_data_2_minus_data_1) and optionally plots and saves it - 
+	shared by point_differences and raster_point_differences
 
-		# get x, y and z value of nn
-	x_nn = data_1['x'].iloc[indxs_nn]
-	y_nn = data_1['y'].iloc[indxs_nn]
-	z_nn = data_1['z'].iloc[indxs_nn]
+	RETURN
 
-	#calculate differences
-	diffs=points_after_drop['z'].values-z_nn.values
-	
+	difference_df
+	"""
 	if plot:
 		plt.scatter(np.arange(0, len(diffs), 1), diffs)
 		if plot_title != '': plt.title(plot_title)#plt.title("Summary of Gravity/MBES differences \n (relative to the DEM provided by I. Fenty (April 2016))")
@@ -95,11 +134,13 @@ def point_differences(data_1, data_2, search_dist=100, output_csv='', plot=True,
 
 		plt.show()
 	
-	# output a new dataframe
-	points_after_drop['data2_x'] = x_nn.values
-	points_after_drop['data2_y'] = y_nn.values
-	points_after_drop['data2_z'] = z_nn.values
-	points_after_drop['DIFF_data_2_minus_data_1'] = diffs
+	# output a new dataframe - built column by column from the masked arrays
+	columns = OrderedDict((col, data_2[col].values[keep]) for col in data_2.columns)
+	columns['data2_x'] = x_ref
+	columns['data2_y'] = y_ref
+	columns['data2_z'] = z_ref
+	columns['DIFF_data_2_minus_data_1'] = diffs
+	points_after_drop = pd.DataFrame(columns)
 
 	# write dataframe to csv
 	if output_csv != "":
@@ -108,6 +149,60 @@ def point_differences(data_1, data_2, search_dist=100, output_csv='', plot=True,
 	else:
 		print("\nNo csv output path set so not saving")
 
-	#if modify_header:
-
 	return points_after_drop
+
+def raster_point_differences(raster_path, data_2, method='bilinear', output_csv='', plot=True, plot_title='', fig_outpath='', 
+							 verbose=True, order=None, band_num=1):
+	"""
+	Compares points directly with a raster (e.g. soundings with a gridded DEM) - the 
+	raster value at each point is looked up / interpolated from the raster with 
+	geotransform index maths (dem_point_operations.sample_raster), so there is no need 
+	to export the raster to xyz (xyz_from_grid) and run point_differences over the 
+	cell centres. Only the raster blocks containing points are read.
+
+	Output is as point_differences with the raster as data_1: data2_x and data2_y are 
+	the centre of the cell each point falls in, data2_z the sampled raster value and 
+	DIFF_data_2_minus_data_1 the point z minus the raster value. Points off the raster 
+	or on nodata are dropped.
+
+	VARIABLES
+
+	raster_path 	= any GDAL readable raster
+	data_2 			= points to compare (pandas dataframe with x, y and z columns)
+	method 			= 'nearest' (value of the cell the point is in - as the old xyz/nearest 
+					  neighbour route), 'bilinear' (default) or 'bicubic'
+	output_csv 		= path to save csv of data comparison - default is '' and no csv is saved
+	plot 			= if True, displays a quick overview plot of the differences (default = True)
+	plot_title 		= title of overview plot - only used if plot is True
+	fig_outpath 	= path to save the plot to
+	verbose 		= print out sanity check messages (default=True)
+	order 			= None, 'hilbert' or 'morton' - process points along a space-filling 
+					  curve (faster for points in acquisition order, see sample_raster)
+	band_num 		= raster band to compare with
+
+	RETURN
+
+	difference_df
+	"""
+	x = data_2['x'].values
+	y = data_2['y'].values
+
+	print("\nSampling raster at points...")
+	z_ref = dem_point_operations.sample_raster(raster_path, x, y, method=method, band_num=band_num, order=order)
+
+	keep = np.isfinite(z_ref)
+	n_dropped = len(data_2) - np.count_nonzero(keep)
+
+	if verbose: print("Total (data_2) observations: %i" %(len(data_2)))
+	if verbose: print("Observations (data_2) off the raster or on nodata (ignored): %i" %(n_dropped))
+	if verbose: print("Observations (data_2) to remain: %i" %(len(data_2)-n_dropped))
+
+	# centre of the cell each point falls in
+	aff = Affine.from_gdal(raster_functions.open_raster_handle(raster_path).geotransform)
+	col, row = aff.world_to_pixel(x[keep], y[keep])
+	x_ref, y_ref = aff.pixel_to_world(col, row, centre=True)
+
+	z_ref = z_ref[keep]
+	diffs = data_2['z'].values[keep] - z_ref
+
+	return difference_output(data_2, keep, x_ref, y_ref, z_ref, diffs, output_csv, plot, plot_title, fig_outpath)
@@ -1,8 +1,13 @@
+from __future__ import division
 import sys
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 sys.path.append('./georaster')
 import georaster 
+import raster_functions
+import spatial_order
+from geotransform import Affine
 
 """
 DEM and point operations
@@ -12,26 +17,196 @@ def extract_values(dem, points, extracted_col_header='extracted_z'):
 		"""
 		Extracts points from a dem at point locations - binds them to a pandas dataframe
 
+		Needs the whole dem in memory - see sample_raster for large dems / many points
+
 		Variables:	
 		dem    : a georaster object
 		points : a pandas dataframe with headers of "x" and "y"
 
 		Returns:
-		points (pandas dataframe)
+		points (pandas dataframe) - points off the dem get NaN
 		"""
 
-		dem_tl_x=dem.extent[0] *-1 #-800000 #*-1 << must do this
-		dem_tl_y=dem.extent[3]     #-599500.
-		post=dem.xres
-
-		pnt_x=points['x'].values
-		pnt_y=points['y'].values
-
-		ix=np.floor((pnt_x+dem_tl_x)/post)   # origin is top left
-		iy=np.floor(((dem_tl_y)-pnt_y)/post) # origin is top left
+		col, row = Affine.from_gdal(dem.trans).world_to_pixel(points['x'].values, points['y'].values)
+		inside = Affine.inside(col, row, dem.r.shape[1], dem.r.shape[0])
 
-		dem_values=dem.r[list(iy),list(ix)]
+		dem_values=np.full(len(points), np.nan)
+		dem_values[inside]=dem.r[row[inside], col[inside]]
 
 		points[extracted_col_header]=pd.Series(dem_values, index=points.index)
 
 		return points
+
+
+# pixels needed either side of a point's pixel for each interpolation method
+SAMPLE_HALO = {'nearest': 0, 'bilinear': 1, 'bicubic': 2}
+BLOCK_CACHE_SIZE = 16 # raster blocks kept in memory by sample_raster
+
+def cubic_weights(t, a=-0.5):
+	"""
+	Keys cubic convolution weights for the 4 pixels at offsets -1, 0, 1, 2 from a 
+	point t (0 <= t < 1) along one axis - a=-0.5 gives the usual bicubic kernel
+
+	Returns:
+	n x 4 array of weights
+	"""
+	t = t[:, None]
+	return np.hstack((((a*t - 2*a)*t + a)*t,
+					  ((a + 2)*t - (a + 3))*t*t + 1,
+					  ((-(a + 2)*t + (2*a + 3))*t - a)*t,
+					  (a - a*t)*t*t))
+
+def _taps(pos, size, method):
+	"""
+	Pixel indices (clamped to the raster edge) and weights along one axis for 
+	fractional pixel positions pos
+
+	Returns:
+	indices (n x k), weights (n x k)
+	"""
+	if method == 'nearest':
+		return np.clip(np.floor(pos), 0, size-1).astype(np.intp)[:, None], np.ones((len(pos), 1))
+
+	u = pos - 0.5 # pixel centres at whole numbers
+	i0 = np.floor(u)
+	f = u - i0
+	if method == 'bilinear':
+		offsets = np.arange(0, 2)
+		weights = np.column_stack((1 - f, f))
+	else:
+		offsets = np.arange(-1, 3)
+		weights = cubic_weights(f)
+	return np.clip(i0[:, None] + offsets, 0, size-1).astype(np.intp), weights
+
+class _BlockReader(object):
+	"""
+	Reads blocks of a raster band (plus a halo, as float64 with nodata as NaN) and 
+	keeps the most recently used ones
+	"""
+
+	def __init__(self, handle, band_num, block_size, halo, cache_size):
+		self.handle = handle
+		self.band = handle.ds.GetRasterBand(band_num)
+		self.nodata = self.band.GetNoDataValue()
+		self.block_xsize, self.block_ysize = block_size
+		self.halo = halo
+		self.cache_size = cache_size
+		self._cache = OrderedDict()
+
+	def block(self, key):
+		"""
+		Returns:
+		xoff, yoff, array of the haloed block
+		"""
+		if key in self._cache:
+			self._cache[key] = self._cache.pop(key)
+			return self._cache[key]
+
+		by, bx = key
+		cols, rows = self.handle.cols, self.handle.rows
+		x0 = max(bx*self.block_xsize - self.halo, 0)
+		y0 = max(by*self.block_ysize - self.halo, 0)
+		x1 = min((bx+1)*self.block_xsize + self.halo, cols)
+		y1 = min((by+1)*self.block_ysize + self.halo, rows)
+
+		raw = self.band.ReadAsArray(x0, y0, x1-x0, y1-y0)
+		arr = raw.astype(np.float64)
+		if self.nodata is not None:
+			# compare in the band's own dtype - e.g. -3.4e38 stored as float32 != -3.4e38 as float64
+			arr[raw == np.array(self.nodata).astype(raw.dtype)] = np.nan
+
+		self._cache[key] = (x0, y0, arr)
+		if len(self._cache) > self.cache_size:
+			self._cache.popitem(last=False)
+		return self._cache[key]
+
+def sample_raster(raster_path, x, y, method='bilinear', band_num=1, chunk_size=1000000, block_size=None, 
+				  min_rows=256, cache_blocks=BLOCK_CACHE_SIZE, order=None):
+	"""
+	Samples a raster at point locations without loading the raster - only the blocks 
+	(plus a halo of 1 or 2 pixels for interpolation) that points fall in are read.
+
+	Points are processed chunk_size at a time, grouped by the raster block they fall 
+	in, so memory use is set by chunk_size and cache_blocks rather than by the number of 
+	points or the raster size. Feeding points in spatial order means each block is read 
+	once - for points in acquisition order set order='hilbert' (or 'morton') to have them 
+	processed along a space-filling curve (see spatial_order.py), with the results put 
+	back in the original order.
+
+	Interpolation is between pixel centres: 'nearest' (value of the pixel the point is in), 
+	'bilinear' or 'bicubic' (Keys cubic convolution, a=-0.5). At the raster edge the edge 
+	pixels are repeated. Points off the raster get NaN, as do points whose interpolation 
+	uses a nodata pixel.
+
+	Variables:
+	raster_path  : any GDAL readable raster
+	x, y         : arrays of point coordinates (in the raster's projection)
+	method       : 'nearest', 'bilinear' (default) or 'bicubic'
+	band_num     : band to sample
+	chunk_size   : number of points processed at a time
+	block_size   : (block_xsize, block_ysize) to read in - default is the native block 
+	               size, with striped rasters read in windows min_rows wide and (at least) 
+	               min_rows scanlines high
+	cache_blocks : number of blocks kept in memory (so at most about 
+	               cache_blocks*block_xsize*block_ysize*8 bytes)
+	order        : None (points processed as given), 'hilbert' or 'morton'
+
+	Returns:
+	array of sampled values (float64, same length as x)
+	"""
+	if method not in SAMPLE_HALO:
+		raise ValueError("method must be one of %s" %', '.join(sorted(SAMPLE_HALO)))
+
+	handle = raster_functions.open_raster_handle(raster_path)
+	if handle is None:
+		sys.exit("Couldn't open this file: " + raster_path)
+	cols, rows = handle.cols, handle.rows
+
+	if block_size is None:
+		bx, by = handle.block_size
+		if bx == cols:
+			# striped - whole strips of a wide raster would make every cached block huge 
+			# (256 rows of a 50000 column DEM is 100 MB as float64), so read min_rows x 
+			# min_rows windows; GDAL's block cache shares the decoded strips between them
+			bx, by = min(cols, min_rows), max(min_rows//by, 1)*by
+		block_size = (bx, by)
+	bx, by = block_size
+	reader = _BlockReader(handle, band_num, block_size, SAMPLE_HALO[method], cache_blocks)
+	aff = Affine.from_gdal(handle.geotransform)
+
+	x = np.asarray(x)
+	y = np.asarray(y)
+	n = len(x)
+	perm = None
+	if order is not None:
+		perm = spatial_order.spatial_order(x, y, curve=order, bounds=aff.bounds(cols, rows))
+
+	out = np.full(n, np.nan)
+	for start in range(0, n, chunk_size):
+		stop = min(start + chunk_size, n)
+		dest = np.arange(start, stop) if perm is None else perm[start:stop]
+		col, row = aff.world_to_pixel(x[dest], y[dest], fractional=True)
+
+		on_grid = np.nonzero((col >= 0) & (col < cols) & (row >= 0) & (row < rows))[0]
+		col, row = col[on_grid], row[on_grid]
+
+		block_id = (row//by).astype(np.int64)*(-(-cols//bx)) + (col//bx).astype(np.int64)
+		by_block = np.argsort(block_id, kind='stable')
+		blocks, first = np.unique(block_id[by_block], return_index=True)
+		last = np.append(first[1:], len(by_block))
+
+		values = np.empty(len(on_grid))
+		for block, i0, i1 in zip(blocks, first, last):
+			pts = by_block[i0:i1]
+			xoff, yoff, arr = reader.block(divmod(int(block), -(-cols//bx)))
+
+			ci, wx = _taps(col[pts], cols, method)
+			ri, wy = _taps(row[pts], rows, method)
+			vals = arr[(ri - yoff)[:, :, None], (ci - xoff)[:, None, :]]
+			weights = wy[:, :, None]*wx[:, None, :]
+			# zero weight pixels don't count (so a nodata neighbour with no weight is ignored)
+			values[pts] = np.where(weights == 0, 0, weights*vals).sum(axis=(1, 2))
+
+		out[dest[on_grid]] = values
+
+	return out
@@ -0,0 +1,198 @@
+'''
+Affine pixel <-> world transforms built from GDAL style geotransforms
+
+	x = gt[0] + col*gt[1] + row*gt[2]
+	y = gt[3] + col*gt[4] + row*gt[5]
+
+(col, row) are pixel coordinates from the top left corner of the top left pixel, so the
+centre of the top left pixel is (0.5, 0.5). Rotation/shear terms (gt[2], gt[4]) are
+supported throughout. Every conversion is one numpy expression over whole arrays - no
+loops, no meshes, no sign fiddling for north up vs south up grids.
+
+e.g.
+aff = Affine.from_gdal(ds.GetGeoTransform())
+col, row = aff.world_to_pixel(points['x'].values, points['y'].values)
+x, y = aff.pixel_to_world(col, row, centre=True)
+coarse = aff * Affine.scaling(4) 					# geotransform of a 4x decimated grid
+xoff, yoff, xsize, ysize = aff.window(xmin, xmax, ymin, ymax, cols, rows)
+sub = aff.window_transform(xoff, yoff) 				# geotransform of that window
+'''
+
+from __future__ import division
+import numpy as np
+
+class Affine(object):
+	'''
+	Affine transform from pixel (col, row) to world (x, y) coordinates - see module docstring.
+
+	Made from the six GDAL geotransform terms, in GDAL order.
+	'''
+
+	def __init__(self, x0, xres, xrot, y0, yrot, yres):
+		self.gt = tuple(float(v) for v in (x0, xres, xrot, y0, yrot, yres))
+
+		det = xres*yres - xrot*yrot
+		if det == 0:
+			raise ValueError("Geotransform is not invertible: %s" %(self.gt,))
+		# inverse coefficients, so world_to_pixel is a single expression too
+		self._inv = (yres/det, -xrot/det, -yrot/det, xres/det)
+
+	@classmethod
+	def from_gdal(cls, geotransform):
+		'''
+		From a 6 term GDAL geotransform, or anything with a GetGeoTransform method
+		(e.g. a GDAL dataset)
+		'''
+		if hasattr(geotransform, 'GetGeoTransform'):
+			geotransform = geotransform.GetGeoTransform()
+		if len(geotransform) != 6:
+			raise ValueError("A GDAL geotransform has 6 terms, got %i" %len(geotransform))
+		return cls(*geotransform)
+
+	@classmethod
+	def from_origin(cls, tl_x, tl_y, post, rotation=0):
+		'''
+		North up transform from the top left corner and pixel size (as define_geotransform_info)
+		'''
+		return cls(tl_x, post, rotation, tl_y, rotation, -post)
+
+	@classmethod
+	def identity(cls):
+		return cls(0, 1, 0, 0, 0, 1)
+
+	@classmethod
+	def translation(cls, dx, dy):
+		return cls(dx, 1, 0, dy, 0, 1)
+
+	@classmethod
+	def scaling(cls, sx, sy=None):
+		if sy is None:
+			sy = sx
+		return cls(0, sx, 0, 0, 0, sy)
+
+	def to_gdal(self):
+		''' 6 term GDAL geotransform (list) '''
+		return list(self.gt)
+
+	@property
+	def xres(self):
+		return self.gt[1]
+
+	@property
+	def yres(self):
+		return self.gt[5]
+
+	@property
+	def is_north_up(self):
+		return self.gt[2] == 0 and self.gt[4] == 0 and self.gt[5] < 0
+
+	def pixel_to_world(self, col, row, centre=False):
+		'''
+		Pixel coordinates -> world coordinates (of the pixel corner, or with centre=True
+		of the centre of pixel [row, col])
+
+		Returns:
+
+		x, y
+		'''
+		x0, a, b, y0, d, e = self.gt
+		col = np.asarray(col, dtype=np.float64)
+		row = np.asarray(row, dtype=np.float64)
+		if centre:
+			col = col + 0.5
+			row = row + 0.5
+		return x0 + a*col + b*row, y0 + d*col + e*row
+
+	def world_to_pixel(self, x, y, fractional=False):
+		'''
+		World coordinates -> pixel coordinates. Points off the grid get indices outside
+		0 <= col < cols, 0 <= row < rows (see inside).
+
+		Returns:
+
+		col, row (integer arrays of the pixel each point falls in, or with fractional=True
+		float pixel coordinates - where 0.5 is the centre of the first pixel)
+		'''
+		x0, a, b, y0, d, e = self.gt
+		ia, ib, id_, ie = self._inv
+		dx = np.asarray(x, dtype=np.float64) - x0
+		dy = np.asarray(y, dtype=np.float64) - y0
+		if b == 0 and d == 0:
+			# no rotation - divide rather than multiply by the inverse, so points on a
+			# cell edge land exactly on it (e.g. 0.3/0.1 rather than 0.3*(1/0.1))
+			col = dx/a
+			row = dy/e
+		else:
+			col = ia*dx + ib*dy
+			row = id_*dx + ie*dy
+		if fractional:
+			return col, row
+		return np.floor(col).astype(np.intp), np.floor(row).astype(np.intp)
+
+	@staticmethod
+	def inside(col, row, cols, rows):
+		''' Boolean mask of which (integer) pixel indices fall on a cols x rows grid '''
+		return (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+
+	def __mul__(self, other):
+		'''
+		Composition - (self * other) applies other first, then self.
+		e.g. aff * Affine.scaling(2) is the transform of a grid with pixels twice the size
+		'''
+		if not isinstance(other, Affine):
+			return NotImplemented
+		x0, a, b, y0, d, e = self.gt
+		ox0, oa, ob, oy0, od, oe = other.gt
+		return Affine(x0 + a*ox0 + b*oy0, a*oa + b*od, a*ob + b*oe,
+					  y0 + d*ox0 + e*oy0, d*oa + e*od, d*ob + e*oe)
+
+	def __invert__(self):
+		''' the inverse transform (world -> pixel) as an Affine '''
+		x0, a, b, y0, d, e = self.gt
+		ia, ib, id_, ie = self._inv
+		return Affine(-(ia*x0 + ib*y0), ia, ib, -(id_*x0 + ie*y0), id_, ie)
+
+	def __eq__(self, other):
+		return isinstance(other, Affine) and self.gt == other.gt
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __repr__(self):
+		return 'Affine(%r, %r, %r, %r, %r, %r)' %self.gt
+
+	def almost_equals(self, other, tol=1e-9):
+		return np.allclose(self.gt, other.gt, rtol=0, atol=tol)
+
+	def window_transform(self, xoff, yoff):
+		''' transform of a window (or subset) whose top left pixel is (xoff, yoff) '''
+		return self * Affine.translation(xoff, yoff)
+
+	def window(self, xmin, xmax, ymin, ymax, cols=None, rows=None):
+		'''
+		Pixel window covering a world bounding box - all pixels touching the box, and
+		with cols and rows given, clipped to the grid
+
+		Returns:
+
+		xoff, yoff, xsize, ysize (ints - sizes are 0 if the box is off the grid)
+		'''
+		col, row = self.world_to_pixel([xmin, xmax, xmin, xmax], [ymin, ymin, ymax, ymax], fractional=True)
+		c0, c1 = int(np.floor(col.min())), int(np.ceil(col.max()))
+		r0, r1 = int(np.floor(row.min())), int(np.ceil(row.max()))
+		if cols is not None:
+			c0, c1 = max(c0, 0), min(c1, cols)
+		if rows is not None:
+			r0, r1 = max(r0, 0), min(r1, rows)
+		return c0, r0, max(c1 - c0, 0), max(r1 - r0, 0)
+
+	def bounds(self, cols, rows):
+		'''
+		World bounding box of a cols x rows grid
+
+		Returns:
+
+		xmin, xmax, ymin, ymax
+		'''
+		x, y = self.pixel_to_world([0, cols, 0, cols], [0, 0, rows, rows])
+		return x.min(), x.max(), y.min(), y.max()
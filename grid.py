@@ -13,6 +13,7 @@ __version__ = "1.0"
 
 import sys
 import numpy as np
+from geotransform import Affine
 
 print("Grid Version: 1.3 imported")
 
@@ -58,20 +59,113 @@ class grid:
 		self.ny=ny
 		self.pixelWidth=pixelWidth
 	
+	def origin(self):
+		"""
+		Top left corner of the grid (whichever corner the grid was set from)
+
+		RETURNS
+
+		top left x, top left y
+		"""
+		if self.corner=='lower_left':
+			return self.bl_x, self.bl_y+(self.pixelWidth*self.ny)
+		return self.tl_x, self.tl_y
+
+	def affine(self):
+		"""
+		geotransform.Affine of the grid (north up, from the top left corner)
+		"""
+		tl_x, tl_y = self.origin()
+		return Affine.from_origin(tl_x, tl_y, self.pixelWidth)
+
+	def geotransform(self):
+		"""
+		GDAL style geotransform of the grid
+		"""
+		return self.affine().to_gdal()
+
+	def x_axis(self, centre=True):
+		"""
+		1D x coordinates of the cell centres (nx values, west to east) or, with 
+		centre=False, of the cell edges (nx+1 values)
+		"""
+		tl_x, tl_y = self.origin()
+		if centre:
+			return tl_x+(np.arange(int(self.nx))+0.5)*self.pixelWidth
+		return tl_x+np.arange(int(self.nx)+1)*self.pixelWidth
+
+	def y_axis(self, centre=True):
+		"""
+		1D y coordinates of the cell centres (ny values, north to south i.e. in row order) 
+		or, with centre=False, of the cell edges (ny+1 values)
+		"""
+		tl_x, tl_y = self.origin()
+		if centre:
+			return tl_y-(np.arange(int(self.ny))+0.5)*self.pixelWidth
+		return tl_y-np.arange(int(self.ny)+1)*self.pixelWidth
+
+	def world_to_pixel(self, x, y, fractional=False):
+		"""
+		Converts world coordinates to pixel indices (row 0 = top row) without building 
+		any meshes - x and y can be scalars or arrays of any size.
+
+		Points off the grid get indices outside 0 <= col < nx, 0 <= row < ny (see inside).
+
+		RETURNS
+
+		col, row (integer arrays, or float arrays of fractional pixel positions if 
+		fractional=True - where 0.5 is the centre of the first cell)
+		"""
+		return self.affine().world_to_pixel(x, y, fractional=fractional)
+
+	def pixel_to_world(self, col, row, centre=True):
+		"""
+		Converts pixel indices (row 0 = top row) to world coordinates of the cell centres 
+		or, with centre=False, of the top left cell corners. Fractional indices are fine.
+
+		RETURNS
+
+		x, y
+		"""
+		return self.affine().pixel_to_world(col, row, centre=centre)
+
+	def inside(self, col, row):
+		"""
+		Boolean mask of which pixel indices (from world_to_pixel) fall on the grid
+		"""
+		return Affine.inside(col, row, int(self.nx), int(self.ny))
+
+	def _mesh(self, key, x, y):
+		"""
+		Memoised, read only x and y meshes built from 1D axes - broadcast views, so no 
+		full size arrays are allocated
+		"""
+		if not hasattr(self, '_meshes'):
+			self._meshes={}
+		if key not in self._meshes:
+			x.flags.writeable=False
+			y=y[::-1]
+			y.flags.writeable=False
+			shape=(len(y), len(x))
+			self._meshes[key]=(np.broadcast_to(x, shape), np.broadcast_to(y[:,None], shape))
+		return self._meshes[key]
+
 	def cell_corner_mesh(self):
 		"""
 		XY mesh where each cell value pertains to the lower left cell corner coordinate
 
 		e.g. x cell value =  lower left cell coordinate
 
+		The meshes are built once and returned as read only views on later calls - copy 
+		them if you need to modify them. Use world_to_pixel/pixel_to_world or x_axis/y_axis 
+		where a full mesh isn't needed.
+
 		RETURNS
 
 		x coordinate mesh
 		y coordinate mesh
 		"""
 
-		print("Running cell corner mesh function")
-
 		if self.corner=='lower_left':
 			tr_x=self.bl_x+(self.pixelWidth*(self.nx+1)) # +1 as grid will be of lower left corners
 			tr_y=self.bl_y+(self.pixelWidth*(self.ny+1)) # +1 as grid will be of lower left corners
@@ -86,9 +180,7 @@ class grid:
 			x=np.arange(self.tl_x,tr_x,self.pixelWidth)
 			y=np.arange(br_y,self.tl_y,self.pixelWidth)
 		
-		xv, yv = np.meshgrid(x, y)
-
-		return xv[::-1], yv[::-1]
+		return self._mesh('corner', x, y)
 
 	def cell_centre_mesh(self):
 		"""
@@ -96,14 +188,14 @@ class grid:
 
 		e.g. x cell value =  lower left x cell coordinate + (pixelWidth/2)
 
+		Built once and returned as read only views on later calls (see cell_corner_mesh)
+
 		RETURNS
 
 		x coordinate mesh
 		y coordinate mesh
 		"""
 
-		print("Running cell centre mesh function")
-
 		if self.corner=='lower_left':
 
 			bl_xc=self.bl_x+(self.pixelWidth/2)
@@ -120,19 +212,11 @@ class grid:
 			tl_xc=self.tl_x+(self.pixelWidth/2) 
 			tl_yc=self.tl_y-(self.pixelWidth/2)
 
-			print("Pixel size: ", self.pixelWidth)
-			print("Input tl corner x: ", self.tl_x)
-			print("Centre corner x: ", tl_xc)
-			print("Input tl corner y: ", self.tl_y)
-			print("Centre corner y: ", tl_yc) 
-
 			tr_xc=tl_xc+(self.pixelWidth*(self.nx))
 			bl_yc=tl_yc-(self.pixelWidth*(self.ny)) 
 
 			x=np.arange(tl_xc,tr_xc,self.pixelWidth) # goes 1 cell less than tr_xc which is fine 
 			y=np.arange(tl_yc,bl_yc,-self.pixelWidth) # as otherwise you've the centre of the next cell off grid
 
-		xv, yv = np.meshgrid(x, y)
-
-		return xv[::-1], yv[::-1]
+		return self._mesh('centre', x, y)
 
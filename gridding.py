@@ -6,9 +6,14 @@ These work mainly for projected coordinate systems
 Chris 17/03/15
 '''
 
-from __future__ import division
+from __future__ import division, print_function
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
+import pickle
+from scipy.spatial import Delaunay, cKDTree
+
+from geotransform import Affine
 
 def corners(top_left_x, top_left_y, post, cols, rows):
 	'''
@@ -32,10 +37,10 @@ def corners(top_left_x, top_left_y, post, cols, rows):
 	bl_x = tl_x
 	bl_y = br_y
 
-	print "tl_northing = %f : tl_easting = %f" %(tl_y, tl_x)
-	print "br_northing = %f : br_easting = %f" %(br_y, br_x)
-	print "bl_northing = %f : bl_easting = %f" %(bl_y, bl_x)
-	print "tr_northing = %f : tr_easting = %f" %(tr_y, tr_x)
+	print("tl_northing = %f : tl_easting = %f" %(tl_y, tl_x))
+	print("br_northing = %f : br_easting = %f" %(br_y, br_x))
+	print("bl_northing = %f : bl_easting = %f" %(bl_y, bl_x))
+	print("tr_northing = %f : tr_easting = %f" %(tr_y, tr_x))
 
 	return [tl_x, tl_y], [tr_x, tr_y],[br_x, br_y],[bl_x, bl_y]
 
@@ -80,10 +85,338 @@ def grid_extent_labels(data, tl_x, tl_y, post, cols, rows, x_interval=200000,y_i
 
 	return [xtick_interval, xtick_labels],[ytick_interval, ytick_labels]
 
-def points_to_avg_grid():
+def grid_geotransform(grid_obj):
+	'''
+	GDAL style geotransform, cols and rows of a grid.grid instance
+
+	Returns:
+
+	geotransform, cols, rows
+	'''
+	return grid_obj.geotransform(), int(grid_obj.nx), int(grid_obj.ny)
+
+def iter_point_chunks(points, chunksize=1000000, sep=',', columns=('x', 'y', 'z')):
+	'''
+	Yields n x 3 (x, y, z) float arrays from any of:
+		- path to a csv (read chunksize rows at a time, using the named columns)
+		- pandas dataframe (using the named columns)
+		- n x 3 array
+		- iterable of n x 3 arrays (e.g. another generator)
+	'''
+	if isinstance(points, str):
+		for df in pd.read_csv(points, sep=sep, usecols=list(columns), chunksize=chunksize):
+			yield df[list(columns)].values.astype(np.float64)
+	elif isinstance(points, pd.DataFrame):
+		yield points[list(columns)].values.astype(np.float64)
+	elif isinstance(points, np.ndarray):
+		for i in range(0, len(points), chunksize):
+			yield np.asarray(points[i:i+chunksize, :3], dtype=np.float64)
+	else:
+		for chunk in points:
+			yield np.asarray(chunk, dtype=np.float64)
+
+def points_to_avg_grid(points, geotransform, cols=None, rows=None, median=False, chunksize=1000000, sep=',', columns=('x', 'y', 'z')):
+	'''
+	Bins scattered xyz points onto a regular (north up) grid in a single pass, giving the 
+	count, mean, min, max and standard deviation of the points falling in each cell.
+
+	Points are read and binned chunksize at a time with np.bincount style accumulators, so 
+	memory use is set by the grid size and not the number of points (except for the median, 
+	which needs every binned point kept - 16 bytes a point). Points outside the grid or with 
+	a NaN z are ignored.
+
+	The count grid is an observation density surface (e.g. for concave_hull_funcs).
+
+	VARIABLES
+
+	points 			= csv path, dataframe, n x 3 array or iterable of n x 3 arrays (see iter_point_chunks)
+	geotransform 	= GDAL style geotransform of the output grid - or a grid.grid instance 
+					  (cols and rows are then taken from it)
+	cols, rows 		= output grid size
+	median 			= also calculate the median (default False)
+
+	Returns:
+
+	dictionary of 2d arrays: 'count', 'mean', 'min', 'max', 'std' (and 'median'). Cells 
+	with no points are NaN (0 in count).
+
+	e.g.
+	g = points_to_avg_grid('soundings.csv', [-800000, 500, 0, -600000, 0, -500], 1200, 2000)
+	plt.imshow(g['mean'])
+	'''
+	if hasattr(geotransform, 'pixelWidth'):
+		geotransform, cols, rows = grid_geotransform(geotransform)
+	aff = Affine.from_gdal(geotransform)
+	n_cells = cols*rows
+
+	count = np.zeros(n_cells, dtype=np.int64)
+	sum_z = np.zeros(n_cells)
+	sum_z2 = np.zeros(n_cells)
+	min_z = np.full(n_cells, np.inf)
+	max_z = np.full(n_cells, -np.inf)
+	kept_idx, kept_z = [], []
+	shift = None # subtracted before summing to limit round off in the variance
+
+	for xyz in iter_point_chunks(points, chunksize, sep, columns):
+		x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+		col, row = aff.world_to_pixel(x, y, fractional=True) # floats, so NaN x/y stay off the grid
+		col, row = np.floor(col), np.floor(row)
+		inside = Affine.inside(col, row, cols, rows) & np.isfinite(z)
+		if not inside.any():
+			continue
+
+		idx = (row[inside]*cols + col[inside]).astype(np.int64)
+		z = z[inside]
+		if shift is None:
+			shift = z.mean()
+		dz = z - shift
+
+		count += np.bincount(idx, minlength=n_cells)
+		sum_z += np.bincount(idx, weights=dz, minlength=n_cells)
+		sum_z2 += np.bincount(idx, weights=dz*dz, minlength=n_cells)
+		np.minimum.at(min_z, idx, z)
+		np.maximum.at(max_z, idx, z)
+
+		if median:
+			kept_idx.append(idx)
+			kept_z.append(z)
+
+	empty = count == 0
+	with np.errstate(invalid='ignore', divide='ignore'):
+		mean_dz = sum_z/count
+		var = np.maximum(sum_z2/count - mean_dz**2, 0)
+
+	grids = {'count': count, 'mean': mean_dz + (shift or 0.), 'min': min_z, 'max': max_z, 'std': np.sqrt(var)}
+	for key in ('mean', 'min', 'max', 'std'):
+		grids[key][empty] = np.nan
+
+	if median:
+		med = np.full(n_cells, np.nan)
+		if kept_idx:
+			idx = np.concatenate(kept_idx)
+			z = np.concatenate(kept_z)
+			order = np.lexsort((z, idx))
+			idx, z = idx[order], z[order]
+			cells, start, n = np.unique(idx, return_index=True, return_counts=True)
+			med[cells] = (z[start + (n-1)//2] + z[start + n//2])/2.
+		grids['median'] = med
+
+	for key in grids:
+		grids[key] = grids[key].reshape(rows, cols)
+
+	return grids
+
+class TriangulationInterpolator(object):
+	'''
+	Linear interpolation of scattered points onto a grid (or any set of target points) - a 
+	replacement for matplotlib.mlab.griddata, which has been removed from matplotlib.
+
+	The Delaunay triangulation of the points is built once. For each set of targets the 
+	containing triangle and barycentric weights of every target are also found once, so 
+	any number of z fields at the same points (e.g. several epochs or variables) can then 
+	be interpolated with a cheap weighted sum.
+
+	e.g.
+	interp = TriangulationInterpolator(x, y).set_targets(xi, yi)
+	z_2014 = interp(z[:, 0])
+	z_all = interp(z) # z is n x k -> output is (len(yi), len(xi), k)
+	'''
+
+	def __init__(self, x, y):
+		self.tri = Delaunay(np.column_stack((x, y)))
+		self.n_points = len(x)
+		self._vertices = None
 
-	#http://stackoverflow.com/questions/26971526/rebin-irregularly-gridded-data-to-regular-2d-grid-in-python-using-mean-median
-	#create observation density grid at the same time :)
+	def set_targets(self, xi, yi, grid=True):
+		'''
+		Sets the points to interpolate to - with grid=True (default) xi and yi are 1d axes 
+		and output has shape (len(yi), len(xi)) as with griddata; otherwise xi and yi are 
+		arrays of target coordinates and output has their shape.
+
+		Returns:
+
+		self
+		'''
+		if grid:
+			xi, yi = np.meshgrid(xi, yi)
+		xi = np.asarray(xi, dtype=np.float64)
+		yi = np.asarray(yi, dtype=np.float64)
+		targets = np.column_stack((xi.ravel(), yi.ravel()))
+
+		simplex = self.tri.find_simplex(targets)
+		self._outside = simplex < 0
+		simplex[self._outside] = 0
+
+		transform = self.tri.transform[simplex]
+		bary = np.einsum('njk,nk->nj', transform[:, :2], targets - transform[:, 2])
+		self._weights = np.column_stack((bary, 1 - bary.sum(axis=1)))
+		self._vertices = self.tri.simplices[simplex]
+		self._shape = xi.shape
+
+		return self
+
+	def __call__(self, z):
+		'''
+		Interpolates z (length n, or n x k for k fields) to the targets - targets outside 
+		the convex hull of the points are NaN
+		'''
+		if self._vertices is None:
+			raise RuntimeError("call set_targets before interpolating")
+		z = np.asarray(z, dtype=np.float64)
+		if z.shape[0] != self.n_points:
+			raise ValueError("z must have one value (or row) per point")
+
+		zi = np.einsum('nj,nj...->n...', self._weights, z[self._vertices])
+		zi[self._outside] = np.nan
+
+		return zi.reshape(self._shape + z.shape[1:])
+
+NEIGHBOUR_METHODS = ('idw', 'nearest', 'knn_mean')
+
+class NeighbourInterpolator(object):
+	'''
+	Neighbourhood based gridding of scattered points with a KD-tree (scipy cKDTree):
+
+		'nearest' 	- value of the nearest point
+		'knn_mean' 	- mean of the k nearest points
+		'idw' 		- inverse distance weighted mean of the k nearest points (weights 1/d**power)
+
+	Only points within radius of a target are used - targets with none are NaN. The tree 
+	is built once, so the same points can be gridded at several resolutions / with several 
+	methods without rebuilding it, and can be saved to disk (save/load) for later runs. 
+	Targets are queried in batches of batch_size across all cores (workers=-1) so memory 
+	use is set by batch_size * k rather than the grid size.
+
+	e.g.
+	interp = NeighbourInterpolator(x, y, z)
+	grid_100m = interp.grid(gt_100m, cols_100m, rows_100m, method='idw', k=12, radius=300.)
+	grid_500m = interp.grid(gt_500m, cols_500m, rows_500m, method='knn_mean', k=50, radius=1000.)
+	'''
+
+	def __init__(self, x, y, z=None):
+		xy = np.column_stack((x, y)).astype(np.float64)
+		keep = np.all(np.isfinite(xy), axis=1)
+		if z is not None:
+			z = np.asarray(z, dtype=np.float64)
+			keep &= np.isfinite(z)
+			z = z[keep]
+		self._keep = keep
+		self.z = z
+		self.tree = cKDTree(xy[keep])
+		self.n_points = self.tree.n
+
+	def save(self, file_name):
+		''' pickles the interpolator (tree included) to file_name '''
+		with open(file_name, 'wb') as f:
+			pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+	@staticmethod
+	def load(file_name):
+		''' reads an interpolator written with save '''
+		with open(file_name, 'rb') as f:
+			return pickle.load(f)
+
+	def _values(self, z):
+		if z is None:
+			if self.z is None:
+				raise ValueError("no z values given")
+			return self.z
+		z = np.asarray(z, dtype=np.float64)
+		if z.shape[0] == len(self._keep):
+			z = z[self._keep]
+		if z.shape[0] != self.n_points:
+			raise ValueError("z must have one value per point")
+		return z
+
+	def interpolate(self, xi, yi, z=None, method='idw', k=8, radius=np.inf, power=2, grid=True, batch_size=65536):
+		'''
+		Interpolates to target points - with grid=True (default) xi and yi are 1d axes and 
+		output has shape (len(yi), len(xi)); otherwise xi and yi are arrays of target 
+		coordinates and output has their shape.
+
+		VARIABLES
+
+		z 			= values at the points (default: the z given when the interpolator was made)
+		method 		= 'idw', 'nearest' or 'knn_mean'
+		k 			= max number of neighbours used (ignored for 'nearest')
+		radius 		= search radius
+		power 		= idw distance power
+		batch_size 	= number of targets queried at a time
+
+		Returns:
+
+		array of interpolated values (NaN where there are no points within radius)
+		'''
+		if method not in NEIGHBOUR_METHODS:
+			raise ValueError("Unknown method %s - use one of %s" %(method, ', '.join(NEIGHBOUR_METHODS)))
+		z = self._values(z)
+		z_pad = np.append(z, np.nan) # missing neighbours come back with index n_points
+		if method == 'nearest':
+			k = 1
+		k = int(min(k, self.n_points))
+
+		if grid:
+			xi, yi = np.asarray(xi, dtype=np.float64), np.asarray(yi, dtype=np.float64)
+			shape = (len(yi), len(xi))
+		else:
+			xi, yi = np.broadcast_arrays(np.asarray(xi, dtype=np.float64), np.asarray(yi, dtype=np.float64))
+			shape = xi.shape
+			xi, yi = xi.ravel(), yi.ravel()
+		n_targets = shape[0]*shape[1] if grid else xi.size
+		out = np.empty(n_targets, dtype=np.float64)
+
+		for start in range(0, n_targets, batch_size):
+			stop = min(start + batch_size, n_targets)
+			if grid:
+				r, c = np.divmod(np.arange(start, stop), shape[1])
+				targets = np.column_stack((xi[c], yi[r]))
+			else:
+				targets = np.column_stack((xi[start:stop], yi[start:stop]))
+
+			dist, idx = self.tree.query(targets, k=k, distance_upper_bound=radius, workers=-1)
+			dist, idx = dist.reshape(len(targets), k), idx.reshape(len(targets), k)
+			values = z_pad[idx]
+			valid = idx < self.n_points
+
+			if method == 'nearest':
+				out[start:stop] = values[:, 0]
+			elif method == 'knn_mean':
+				n = valid.sum(axis=1)
+				with np.errstate(invalid='ignore', divide='ignore'):
+					out[start:stop] = np.where(valid, values, 0).sum(axis=1)/n
+			else:
+				with np.errstate(divide='ignore'):
+					weights = np.where(valid, 1./dist**power, 0)
+				exact = dist[:, 0] == 0 # target on a point -> take its value
+				weights[exact] = 0
+				weights[exact, 0] = 1
+				with np.errstate(invalid='ignore', divide='ignore'):
+					out[start:stop] = (weights*np.where(valid, values, 0)).sum(axis=1)/weights.sum(axis=1)
+
+		return out.reshape(shape)
+
+	def grid(self, geotransform, cols, rows, z=None, method='idw', **options):
+		'''
+		Interpolates to the cell centres of a (north up) grid given by a GDAL style 
+		geotransform - options are as for interpolate.
+
+		Returns:
+
+		(rows, cols) array
+		'''
+		aff = Affine.from_gdal(geotransform)
+		xi = aff.pixel_to_world(np.arange(cols), 0, centre=True)[0]
+		yi = aff.pixel_to_world(0, np.arange(rows), centre=True)[1]
+		return self.interpolate(xi, yi, z, method=method, grid=True, **options)
+
+def griddata_linear(x, y, z, xi, yi):
+	'''
+	Drop in replacement for matplotlib.mlab.griddata(x, y, z, xi, yi, interp='linear') - 
+	returns a masked array of shape (len(yi), len(xi)), masked outside the convex hull.
+
+	Use TriangulationInterpolator directly to grid several z fields from the same points.
+	'''
+	return np.ma.masked_invalid(TriangulationInterpolator(x, y).set_targets(xi, yi)(z))
 
 def points_to_grid_linear_interp():
 	############################################################
@@ -93,16 +426,14 @@ def points_to_grid_linear_interp():
 	grid_1km="O:/Documents/CHRIS_Bristol/Gridding/trial/land_1km.txt"
 	post = 1000
 	df_lnd = pd.read_csv(grid_1km, sep = "\s*", skiprows=5, header=None, names=['x','y','z']) 
-	x_lnd = df['x'].values
-	y_lnd = df['y'].values
-	z_lnd = df['z'].values
+	x_lnd = df_lnd['x'].values
+	y_lnd = df_lnd['y'].values
+	z_lnd = df_lnd['z'].values
 
 	##Mesh Grid
 	xi_lnd = np.linspace(min(x_lnd), max(x_lnd), post)
 	yi_lnd = np.linspace(min(y_lnd), max(y_lnd), post)
-	Y_lnd, X_lnd = np.meshgrid(yi, xi,indexing='ij')
 
 	##Grid data (using linear interpolation)
-	#Z = ml.griddata(x, y, z, xi, yi, interp='linear')
-	Z_lnd = ml.griddata(x_lnd, y_lnd, z_lnd, xi_lnd, yi_lnd)
-	plt.imshow(Z_lnd, origin='lower'), plt.colorbar(), plt.show()
\ No newline at end of file
+	Z_lnd = griddata_linear(x_lnd, y_lnd, z_lnd, xi_lnd, yi_lnd)
+	plt.imshow(Z_lnd, origin='lower'), plt.colorbar(), plt.show()
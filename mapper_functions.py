@@ -7,9 +7,9 @@ including seed formatting, cooridnate transformations and raster I/Opens
 import os
 import pandas as pd
 import numpy as np
-from osgeo import gdal, osr
-from osgeo.gdalconst import *
 import matplotlib.pyplot as plt
+import raster_functions
+from geotransform import Affine
 from channel_mapper_expt import Path, ChannelObjective, Charge
 
 def check_output_dir(filename):
@@ -30,9 +30,7 @@ def open_raster(raster_path):
     Returns a gdal dataset and an array of the raster
     """
 
-    driver = gdal.GetDriverByName('Gtiff')
-    driver.Register()
-    dataset = gdal.Open(raster_path, GA_ReadOnly)
+    dataset = raster_functions.open_raster_handle(raster_path).ds
     data=dataset.ReadAsArray()
     print("Opened %s" %(raster_path))
     
@@ -77,16 +75,11 @@ def npstereo_to_grid_xy_MORLIG_FORMAT(arr, msk_geodata, seeds, show_plots=0):
 	Returns an x,y,z list
 	"""
 
-	#calc corners
-	geotransform=msk_geodata.GetGeoTransform()
-	post=geotransform[1]
-
 	#open up seeds
 	seeds_csv=pd.read_csv(seeds, sep=',')
 
 	#calc grid coords	
-	x=abs(seeds_csv['x_bamber'].values-geotransform[0])/post
-	y=abs(seeds_csv['y_bamber'].values-geotransform[3])/post
+	x, y = Affine.from_gdal(msk_geodata).world_to_pixel(seeds_csv['x_bamber'].values, seeds_csv['y_bamber'].values, fractional=True)
 	z=seeds_csv['bed_elev_gimp_thick_m'].values
 
 	if show_plots==1:
@@ -106,16 +99,11 @@ def npstereo_to_grid_xy_MANUALLY_SEEDED(arr, mask_geodata, seeds, show_plots=0):
 	Returns an x,y,z list
 	"""
 
-	#calc corners
-	geotransform=mask_geodata.GetGeoTransform()
-	post=geotransform[1]
-
 	#open up seeds
 	seeds_csv=pd.read_csv(seeds, sep=',')
 
 	#calc grid coords	
-	x=abs(seeds_csv['X'].values-geotransform[0])/post
-	y=abs(seeds_csv['Y'].values-geotransform[3])/post
+	x, y = Affine.from_gdal(mask_geodata).world_to_pixel(seeds_csv['X'].values, seeds_csv['Y'].values, fractional=True)
 	
 	if show_plots==1:
 		plt.imshow(arr)
@@ -139,13 +127,8 @@ def grid_xy_to_map_xy(grid_xy, mask_geodata):
 	coordinate_xy  : list of xy map coordinates
 	"""
 
-	#calc corners
-	geotransform=mask_geodata.GetGeoTransform()
-	post=geotransform[1]
-
 	#from grid to spatial
-	x=(grid_xy[:,0]*post)+geotransform[0]
-	y=((grid_xy[:,1]*post)*-1)+geotransform[3]
+	x, y = Affine.from_gdal(mask_geodata).pixel_to_world(grid_xy[:,0], grid_xy[:,1])
 
 	coordinate_xy=np.vstack([x, y]).transpose()
 	
@@ -36,6 +36,7 @@ from matplotlib.colors import LightSource
 from matplotlib import rcParams
 
 import georaster
+import raster_functions
 
 
 class Map:
@@ -78,11 +79,11 @@ class Map:
         """
 
         # Use handle to existing figure
-        if fig <> None and ax <> None:
+        if fig != None and ax != None:
             self.fig = fig
             self.ax = ax
         # Create figure of specified size
-        elif figsize <> None:
+        elif figsize != None:
             self.fig = plt.figure(figsize=figsize)
             self.ax = plt.subplot(111)
         # Create figure at system default size
@@ -93,14 +94,14 @@ class Map:
 
         # Get basic georeferencing info for map
         # From a geoTIFF
-        if ds_file <> None:
+        if ds_file != None:
             ds = georaster.SingleBandRaster(ds_file,load_data=False)
             extent = ds.get_extent_latlon()  
             lon_0 = ds.srs.GetProjParm('central_meridian')
         # Otherwise check that it has been provided manually
         else:
             if (extent == None) or (lon_0 == None):
-                print 'Either ds_file must be provided, or extent and lon_0.'
+                print('Either ds_file must be provided, or extent and lon_0.')
                 raise AttributeError
 
         self.extent = extent
@@ -127,16 +128,21 @@ class Map:
 
         """
 
-        if region == 'all':
+        if region == 'all' and type(coarse) == int:
+            # Only read the pixels that will be shown (uses overviews if present)
+            bg = georaster.SingleBandRaster(bg_file,load_data=False)
+            bg.r = raster_functions.read_decimated(bg_file,factor=coarse,
+                                                   resampling='nearest')[0]
+        elif region == 'all':
             bg = georaster.SingleBandRaster(bg_file)
         else:
             bg = georaster.SingleBandRaster(bg_file,load_data=region,
                                               latlon=True)
 
-        # Reduce image resolution
-        if coarse <> False:
-            if type(coarse) == int:
-                bg.r = bg.r[::coarse,::coarse]
+            # Reduce image resolution
+            if coarse != False:
+                if type(coarse) == int:
+                    bg.r = bg.r[::coarse,::coarse]
 
         bg.r = np.where(bg.r == 0,np.nan,bg.r)   #remove black color
         plt.imshow(bg.r,cmap=cm.Greys_r,
@@ -264,7 +270,7 @@ class Map:
             linewidth=0.3,zorder=1000)
         if rotate_parallels == True and 1 in plabels:
             # Rotate text labels for parallels to save space
-            for k,p in parallels.iteritems():
+            for k,p in parallels.items():
                 # p[1][0] is a text instance
                 item = p[1][0]
                 item.set_rotation('vertical')
@@ -0,0 +1,276 @@
+'''
+Persistent on-disk spatial index of reference point files, for repeated nearest
+neighbour comparisons (e.g. data_comparison.point_differences against the same
+gravity survey / DEM points many times).
+
+GridIndex is a grid-bucket index: points sorted by the grid cell they fall in, plus
+the ids of the occupied cells and the offset of each one's first point (empty cells
+aren't stored, so sparse surveys over a large extent stay small). Everything is plain
+arrays saved as .npy, so a cached index is opened with mmap_mode='r' - almost no load
+time, and only the pages a query touches are read.
+
+PointIndexCache keeps one index per (point file, cell size) in a cache directory,
+keyed by the file's path, modification time and size (or its content hash), and
+evicts least recently used indexes once the cache is over max_bytes.
+
+e.g.
+cache = PointIndexCache('/scratch/point_index_cache', max_bytes=5*1024**3)
+index = cache.get('gravity_bathy.csv', cell_size=100.)
+dists, pos = index.query(mbes['x'].values, mbes['y'].values, radius=100.)
+z_nn = index.z[pos[np.isfinite(dists)]]
+'''
+
+from __future__ import division, print_function
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import spatial_order
+
+INDEX_ARRAYS = ('x', 'y', 'z', 'rows', 'cells', 'cell_start')
+META_FILE = 'meta.json'
+INDEX_VERSION = 2 # part of the cache key, so indexes in an older layout are rebuilt
+
+class GridIndex(object):
+	'''
+	Grid-bucket spatial index of 2D points - see module docstring.
+
+	Point arrays (x, y, z) are held in cell order - 'rows' gives each point's row in
+	the original data. 'cells' holds the (sorted) ids of the occupied cells and the
+	points in cells[i] are cell_start[i]:cell_start[i+1]. Make one with GridIndex.build()
+	or GridIndex.load().
+	'''
+
+	def __init__(self, arrays, meta):
+		for name in INDEX_ARRAYS:
+			setattr(self, name, arrays[name])
+		self.meta = meta
+		self.x0, self.y0 = meta['origin']
+		self.cell_size = meta['cell_size']
+		self.nx, self.ny = meta['nx'], meta['ny']
+		self.n_points = len(self.x)
+
+	@classmethod
+	def build(cls, x, y, z=None, cell_size=100.):
+		'''
+		Builds an index of points (non-finite x/y are left out)
+
+		Returns:
+
+		GridIndex
+		'''
+		x = np.asarray(x, dtype=np.float64)
+		y = np.asarray(y, dtype=np.float64)
+		z = np.zeros(len(x)) if z is None else np.asarray(z, dtype=np.float64)
+		rows = np.nonzero(np.isfinite(x) & np.isfinite(y))[0]
+		x, y, z = x[rows], y[rows], z[rows]
+
+		x0, y0 = (x.min(), y.min()) if len(x) else (0., 0.)
+		nx = int((x.max() - x0)//cell_size) + 1 if len(x) else 1
+		ny = int((y.max() - y0)//cell_size) + 1 if len(x) else 1
+		cell = ((y - y0)//cell_size).astype(np.int64)*nx + ((x - x0)//cell_size).astype(np.int64)
+
+		order = np.argsort(cell, kind='stable')
+		cells, cell_start = np.unique(cell[order], return_index=True)
+		cell_start = np.append(cell_start, len(cell)).astype(np.int64)
+
+		arrays = {'x': x[order], 'y': y[order], 'z': z[order], 'rows': rows[order], 'cells': cells,
+				  'cell_start': cell_start}
+		meta = {'origin': [float(x0), float(y0)], 'cell_size': float(cell_size), 'nx': nx, 'ny': ny}
+		return cls(arrays, meta)
+
+	def save(self, index_dir):
+		''' writes the index arrays (.npy) and meta.json to index_dir '''
+		if not os.path.isdir(index_dir):
+			os.makedirs(index_dir)
+		for name in INDEX_ARRAYS:
+			np.save(os.path.join(index_dir, name + '.npy'), getattr(self, name))
+		with open(os.path.join(index_dir, META_FILE), 'w') as f:
+			json.dump(self.meta, f, indent=1)
+
+	@classmethod
+	def load(cls, index_dir, mmap_mode='r'):
+		''' opens an index written with save - arrays are memory mapped by default '''
+		with open(os.path.join(index_dir, META_FILE), 'r') as f:
+			meta = json.load(f)
+		arrays = dict((name, np.load(os.path.join(index_dir, name + '.npy'), mmap_mode=mmap_mode))
+					  for name in INDEX_ARRAYS)
+		return cls(arrays, meta)
+
+	def query(self, qx, qy, radius, chunk_size=1000000):
+		'''
+		Nearest indexed point to each query point, closer than radius - a point exactly
+		radius away isn't found, as with cKDTree's distance_upper_bound. Only the cells
+		within radius of each query point are searched, so keep the cell size close to
+		the radius.
+
+		Returns:
+
+		distances (inf where there is no point within radius), positions in the index
+		arrays (self.x, self.z... - n_points where there is no point) - use self.rows[pos]
+		for rows of the original data
+		'''
+		qx = np.asarray(qx, dtype=np.float64)
+		qy = np.asarray(qy, dtype=np.float64)
+		n = len(qx)
+
+		# work through the queries in cell order so neighbouring queries read the same
+		# (cached) parts of the index, then put the results back in the original order
+		query_cell = np.floor((qy - self.y0)/self.cell_size)*self.nx + np.floor((qx - self.x0)/self.cell_size)
+		query_cell[~np.isfinite(query_cell)] = -1
+		query_order = np.argsort(query_cell.astype(np.int64), kind='stable')
+		del query_cell
+		qx, qy = qx[query_order], qy[query_order]
+		dists = np.full(n, np.inf)
+		pos = np.full(n, self.n_points, dtype=np.int64)
+
+		reach = int(np.ceil(radius/self.cell_size))
+		offsets = [(dy, dx) for dy in range(-reach, reach+1) for dx in range(-reach, reach+1)]
+
+		for start in range(0, n, chunk_size):
+			stop = min(start + chunk_size, n)
+			cx = np.floor((qx[start:stop] - self.x0)/self.cell_size)
+			cy = np.floor((qy[start:stop] - self.y0)/self.cell_size)
+
+			x_chunk, y_chunk = qx[start:stop], qy[start:stop]
+			best_d2 = np.full(stop - start, np.inf)
+			best_p = np.full(stop - start, self.n_points, dtype=np.int64)
+
+			# one neighbouring cell offset at a time - each query's candidates are a
+			# contiguous run, so the closest in each run is found without sorting
+			for dy, dx in offsets:
+				ix, iy = cx + dx, cy + dy
+				q = np.nonzero((ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny))[0]
+				cell = iy[q].astype(np.int64)*self.nx + ix[q].astype(np.int64)
+				k = np.searchsorted(self.cells, cell)
+				occupied = k < len(self.cells)
+				occupied[occupied] = self.cells[k[occupied]] == cell[occupied]
+				q, k = q[occupied], k[occupied]
+				if len(q) == 0:
+					continue
+				first = self.cell_start[k]
+				counts = self.cell_start[k + 1] - first
+
+				run_start = np.cumsum(counts) - counts
+				p = np.repeat(first - run_start, counts) + np.arange(counts.sum())
+				q_rep = np.repeat(q, counts)
+				d2 = (self.x[p] - x_chunk[q_rep])**2 + (self.y[p] - y_chunk[q_rep])**2
+
+				run_min = np.minimum.reduceat(d2, run_start)
+				closest = d2 == np.repeat(run_min, counts)
+				run_p = np.empty(len(q), dtype=np.int64)
+				run_p[np.repeat(np.arange(len(q)), counts)[closest]] = p[closest]
+
+				better = run_min < best_d2[q]
+				best_d2[q[better]] = run_min[better]
+				best_p[q[better]] = run_p[better]
+
+			d = np.sqrt(best_d2)
+			near = d < radius
+			dists[start:stop][near] = d[near]
+			pos[start:stop][near] = best_p[near]
+
+		return spatial_order.scatter_back(dists, query_order), spatial_order.scatter_back(pos, query_order)
+
+
+def file_key(file_name, cell_size, content_hash=False, chunk_bytes=2**24):
+	'''
+	Cache key for a point file at a cell size - from its path, modification time and
+	size, or with content_hash=True the sha1 of its contents (survives copies/touches
+	but reads the whole file)
+
+	Returns:
+
+	hex string
+	'''
+	h = hashlib.sha1()
+	if content_hash:
+		with open(file_name, 'rb') as f:
+			for block in iter(lambda: f.read(chunk_bytes), b''):
+				h.update(block)
+	else:
+		stat = os.stat(file_name)
+		h.update(('%s|%r|%i' %(os.path.abspath(file_name), stat.st_mtime, stat.st_size)).encode('utf-8'))
+	h.update(('|%r|%i' %(float(cell_size), INDEX_VERSION)).encode('utf-8'))
+	return h.hexdigest()
+
+def _dir_size(path):
+	return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+class PointIndexCache(object):
+	'''
+	Directory of GridIndexes for point files, with size based LRU eviction - see module
+	docstring
+	'''
+
+	def __init__(self, cache_dir, max_bytes=2*1024**3, content_hash=False):
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.content_hash = content_hash
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+
+	def entries(self):
+		''' cached index directories, least recently used first '''
+		dirs = [os.path.join(self.cache_dir, d) for d in os.listdir(self.cache_dir)]
+		dirs = [d for d in dirs if os.path.isfile(os.path.join(d, META_FILE))]
+		return sorted(dirs, key=lambda d: os.path.getmtime(os.path.join(d, META_FILE)))
+
+	def get(self, file_name, cell_size, sep=',', columns=('x', 'y', 'z')):
+		'''
+		Index of a csv of points at cell_size - loaded (memory mapped) from the cache if
+		the file hasn't changed, otherwise built, saved to the cache and loaded.
+
+		Returns:
+
+		GridIndex
+		'''
+		index_dir = os.path.join(self.cache_dir, file_key(file_name, cell_size, self.content_hash))
+		meta_file = os.path.join(index_dir, META_FILE)
+
+		if os.path.isfile(meta_file):
+			os.utime(meta_file, None) # mark as recently used
+			return GridIndex.load(index_dir)
+
+		print("Building spatial index of %s (cell size %g)" %(file_name, cell_size))
+		points = pd.read_csv(file_name, sep=sep, usecols=list(columns))
+		index = GridIndex.build(*[points[c].values for c in columns], cell_size=cell_size)
+
+		# write to a temporary directory first so a half written index is never picked up
+		tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+		index.save(tmp_dir)
+		try:
+			os.rename(tmp_dir, index_dir)
+		except OSError: # built at the same time by another process
+			shutil.rmtree(tmp_dir, ignore_errors=True)
+
+		self.evict(keep=index_dir)
+		return GridIndex.load(index_dir)
+
+	def evict(self, keep=None):
+		'''
+		Removes least recently used indexes until the cache is within max_bytes (the
+		index in 'keep' is never removed)
+		'''
+		entries = self.entries()
+		sizes = dict((d, _dir_size(d)) for d in entries)
+		total = sum(sizes.values())
+		for d in entries:
+			if total <= self.max_bytes:
+				break
+			if keep is not None and os.path.abspath(d) == os.path.abspath(keep):
+				continue
+			shutil.rmtree(d, ignore_errors=True)
+			total -= sizes[d]
+			print("Evicted %s from the index cache" %d)
+
+	def clear(self):
+		''' removes every cached index '''
+		for d in self.entries():
+			shutil.rmtree(d, ignore_errors=True)
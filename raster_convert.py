@@ -0,0 +1,202 @@
+'''
+Batch conversion of rasters (ENVI binaries, Arc ASCII grids, GeoTIFFs - anything GDAL
+reads) to GeoTIFF, spread over a pool of processes.
+
+Each file is streamed through block by block (raster_functions.iter_blocks ->
+raster_functions.tiff_from_blocks) so memory use stays flat whatever the raster size.
+Outputs newer than their inputs are skipped, so an interrupted run can just be restarted.
+
+Usage:
+
+python raster_convert.py "/data/epochs/*.bin" -o /data/epochs_tif --compress DEFLATE --predictor --cog
+python raster_convert.py /data/asc_grids -o /data/tifs --workers 8
+'''
+
+from __future__ import division, print_function
+import os
+import sys
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import raster_functions
+
+# Files picked up when a directory is given (ENVI binaries are also picked up by their .hdr)
+INPUT_EXTENSIONS = ('.tif', '.tiff', '.asc', '.bin', '.dat', '.img', '.envi')
+
+def input_files(pattern):
+	'''
+	Expands a directory (all rasters in it) or a glob pattern to a sorted list of files
+	'''
+	if os.path.isdir(pattern):
+		files = []
+		for name in os.listdir(pattern):
+			path = os.path.join(pattern, name)
+			stem, ext = os.path.splitext(path)
+			if ext.lower() == '.hdr':
+				# ENVI - the binary is either stem or stem + one of the usual extensions
+				if os.path.isfile(stem) and not os.path.splitext(stem)[1]:
+					files.append(stem)
+			elif ext.lower() in INPUT_EXTENSIONS:
+				files.append(path)
+		return sorted(set(files))
+	return sorted(f for f in glob.glob(pattern) if not f.lower().endswith(('.hdr', '.aux.xml')))
+
+def source_files(file_in):
+	'''
+	The file plus any sidecar header (e.g. an ENVI .hdr) it depends on
+	'''
+	sources = [file_in]
+	for hdr_file in (file_in + '.hdr', os.path.splitext(file_in)[0] + '.hdr'):
+		if os.path.isfile(hdr_file):
+			sources.append(hdr_file)
+	return sources
+
+def up_to_date(file_in, file_out):
+	'''
+	True if file_out exists and is newer than file_in (and its header)
+	'''
+	if not os.path.isfile(file_out):
+		return False
+	out_mtime = os.path.getmtime(file_out)
+	return all(os.path.getmtime(f) <= out_mtime for f in source_files(file_in))
+
+def output_files(files, out_dir):
+	'''
+	GeoTIFF name in out_dir for each input - the input's name with a .tif extension, or 
+	where inputs share a name (e.g. dem.asc and dem.bin) the input extension is kept too 
+	(dem_asc.tif, dem_bin.tif) so two processes never write the same file
+
+	Returns:
+
+	dict of file_in: file_out
+	'''
+	by_stem = {}
+	for file_in in files:
+		by_stem.setdefault(os.path.splitext(os.path.basename(file_in))[0], []).append(file_in)
+
+	file_outs = {}
+	for stem, same_stem in by_stem.items():
+		for file_in in same_stem:
+			ext = os.path.splitext(file_in)[1].lstrip('.')
+			name = stem + '_' + ext if len(same_stem) > 1 and ext else stem
+			file_outs[file_in] = os.path.join(out_dir, name + '.tif')
+
+	# anything still clashing (e.g. the same name in two directories of a glob)
+	seen = {}
+	for file_in in files:
+		seen.setdefault(file_outs[file_in], []).append(file_in)
+	clashes = [sources for sources in seen.values() if len(sources) > 1]
+	if clashes:
+		sys.exit("These inputs would be written to the same output:\n" + 
+				 "\n".join(', '.join(sources) for sources in clashes))
+
+	return file_outs
+
+def convert_file(file_in, file_out, tiff_options):
+	'''
+	Converts one raster (all of its bands) to GeoTIFF, block by block. Written to a 
+	temporary name first, which is removed if the conversion fails, so a half written 
+	file is never mistaken for a finished one.
+
+	Returns:
+
+	number of input bytes read
+	'''
+	handle = raster_functions.open_raster_handle(file_in)
+	if handle is None:
+		raise IOError("Couldn't open this file: " + file_in)
+
+	# every band is streamed through (multi-band ENVI stacks stay multi-band)
+	band_num = 1 if handle.bands == 1 else None
+	file_part = file_out + '.part'
+	try:
+		raster_functions.tiff_from_blocks(file_part, raster_functions.iter_blocks(file_in, band_num=band_num),
+										  handle.cols, handle.rows, handle.geotransform,
+										  handle.projection, nodata=handle.nodata, bands=handle.bands,
+										  **tiff_options)
+		os.replace(file_part, file_out)
+	except BaseException:
+		if os.path.exists(file_part):
+			os.remove(file_part)
+		raise
+
+	return sum(os.path.getsize(f) for f in source_files(file_in))
+
+def convert(files, out_dir, tiff_options, workers=None, force=False):
+	'''
+	Converts a list of rasters to GeoTIFFs in out_dir using a pool of processes, skipping
+	any that are already up to date (unless force=True), and prints a throughput summary
+
+	Returns:
+
+	list of (file_in, error message) for any files that failed
+	'''
+	if not os.path.isdir(out_dir):
+		os.makedirs(out_dir)
+
+	jobs = []
+	skipped = 0
+	file_outs = output_files(files, out_dir)
+	for file_in in files:
+		file_out = file_outs[file_in]
+		if not force and up_to_date(file_in, file_out):
+			skipped += 1
+		else:
+			jobs.append((file_in, file_out))
+
+	print("%i files to convert, %i already up to date" %(len(jobs), skipped))
+
+	start = time.time()
+	n_bytes = 0
+	failed = []
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		futures = dict((pool.submit(convert_file, file_in, file_out, tiff_options), file_in) for file_in, file_out in jobs)
+		for i, future in enumerate(as_completed(futures)):
+			file_in = futures[future]
+			try:
+				n_bytes += future.result()
+				print("[%i/%i] %s" %(i+1, len(jobs), file_in))
+			except Exception as e:
+				failed.append((file_in, str(e)))
+				print("[%i/%i] FAILED %s: %s" %(i+1, len(jobs), file_in, e))
+
+	elapsed = max(time.time() - start, 1e-9)
+	n_done = len(jobs) - len(failed)
+	print("\nConverted %i files (%.1f MB) in %.1f s: %.2f files/s, %.1f MB/s"
+		  %(n_done, n_bytes/1e6, elapsed, n_done/elapsed, n_bytes/1e6/elapsed))
+	if failed:
+		print("%i files failed" %len(failed))
+
+	return failed
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Convert ENVI/ASCII/GeoTIFF rasters to (tiled, compressed) GeoTIFFs")
+	parser.add_argument('inputs', help="directory of rasters, or a quoted glob pattern e.g. '/data/*.bin'")
+	parser.add_argument('-o', '--out_dir', required=True, help="output directory")
+	parser.add_argument('--workers', type=int, default=None, help="number of processes (default: number of CPUs)")
+	parser.add_argument('--force', action='store_true', help="convert even if the output is up to date")
+	parser.add_argument('--striped', action='store_true', help="write strips rather than internal tiles")
+	parser.add_argument('--blocksize', type=int, default=256, help="tile size (default 256)")
+	parser.add_argument('--compress', default=None, help="DEFLATE, LZW, ZSTD...")
+	parser.add_argument('--predictor', action='store_true', help="use a predictor suited to the data type when compressing")
+	parser.add_argument('--bigtiff', action='store_true', help="force BigTIFF")
+	parser.add_argument('--overviews', action='store_true', help="add internal overviews")
+	parser.add_argument('--cog', action='store_true', help="write Cloud-Optimized GeoTIFFs")
+	args = parser.parse_args(argv)
+
+	files = input_files(args.inputs)
+	if not files:
+		sys.exit("No rasters found matching %s" %args.inputs)
+
+	tiff_options = dict(tiled=not args.striped, blocksize=args.blocksize, compress=args.compress,
+						predictor=True if args.predictor else None, bigtiff=True if args.bigtiff else None,
+						overviews=args.overviews, cog=args.cog)
+
+	failed = convert(files, args.out_dir, tiff_options, workers=args.workers, force=args.force)
+	if failed:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
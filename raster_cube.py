@@ -0,0 +1,212 @@
+'''
+On-disk, chunked time-series cube of co-registered rasters (e.g. epoch DEMs or
+velocity mosaics) - an alternative to reading every raster in and np.dstack-ing them.
+
+The cube is a directory of .npy chunk files (each a (time, rows, cols) box) plus an
+index.json holding the shape, chunk shape, dtype and georeferencing. Chunks are memory
+mapped when read so only the chunks (and pages) a read touches come off disk.
+
+The chunk shape sets which reads are fast:
+	time-major  e.g. chunks=(1, 1024, 1024)  - whole spatial slices
+	space-major e.g. chunks=(None, 64, 64)   - whole time series for a pixel (None = all epochs)
+
+e.g.
+cube = RasterCube.build(sorted(glob('dems/*.tif')), 'dem_cube', chunks=(None, 128, 128))
+series = cube.pixel_series(row, col)
+for (t, rows, cols), block in cube.iter_chunks():
+	...per-pixel trends on block...
+'''
+
+from __future__ import division, print_function
+import os
+import sys
+import json
+
+import numpy as np
+
+import raster_functions
+
+INDEX_FILE = 'index.json'
+
+def _as_slice(index, size):
+	'''
+	int or slice (step 1 only) -> (start, stop, was_int)
+	'''
+	if isinstance(index, slice):
+		start, stop, step = index.indices(size)
+		if step != 1:
+			sys.exit("RasterCube reads only support a step of 1")
+		return start, max(start, stop), False
+	index = int(index)
+	if index < 0:
+		index += size
+	if not 0 <= index < size:
+		raise IndexError("index %i out of range for axis of size %i" %(index, size))
+	return index, index+1, True
+
+
+class RasterCube(object):
+	'''
+	A (time, rows, cols) stack of rasters held on disk in chunks - see module docstring.
+
+	Open an existing cube with RasterCube(cube_dir), make one with RasterCube.build().
+	'''
+
+	def __init__(self, cube_dir):
+		self.cube_dir = cube_dir
+		with open(os.path.join(cube_dir, INDEX_FILE), 'r') as f:
+			index = json.load(f)
+
+		self.shape = tuple(index['shape'])
+		self.chunks = tuple(index['chunks'])
+		self.dtype = np.dtype(index['dtype'])
+		self.geotransform = index['geotransform']
+		self.projection = index['projection']
+		self.labels = index['labels']
+		self.files = index['files']
+
+	@classmethod
+	def build(cls, raster_files, cube_dir, chunks=(None, 256, 256), dtype='float32', labels=None):
+		'''
+		Writes a list of co-registered rasters (same size and geotransform) into a new cube.
+
+		Rasters are read one band of chunk rows at a time, so memory use is set by the
+		chunk shape and not by the number or size of rasters. Nodata is stored as NaN
+		for float cubes.
+
+		VARIABLES
+
+		raster_files 	= list of rasters, in time order
+		cube_dir 		= directory to write the cube to
+		chunks 			= (time, rows, cols) chunk shape, None meaning the full axis
+		dtype 			= dtype the cube is stored as
+		labels 			= optional list of labels (e.g. dates) for each raster
+
+		Returns:
+
+		RasterCube
+		'''
+		handles = [raster_functions.open_raster_handle(f) for f in raster_files]
+		for f, handle in zip(raster_files, handles):
+			if handle is None:
+				sys.exit("Couldn't open this file: " + f)
+			if handle.shape != handles[0].shape or tuple(handle.geotransform) != tuple(handles[0].geotransform):
+				sys.exit("%s is not aligned with %s" %(f, raster_files[0]))
+
+		shape = (len(raster_files),) + handles[0].shape
+		chunks = tuple(s if c is None else min(int(c), s) for c, s in zip(chunks, shape))
+		dtype = np.dtype(dtype)
+
+		if not os.path.isdir(cube_dir):
+			os.makedirs(cube_dir)
+
+		index = {'shape': shape, 'chunks': chunks, 'dtype': dtype.str,
+				 'geotransform': list(handles[0].geotransform), 'projection': handles[0].projection,
+				 'labels': list(labels) if labels is not None else [os.path.basename(f) for f in raster_files],
+				 'files': [os.path.abspath(f) for f in raster_files]}
+
+		cube = cls.__new__(cls)
+		cube.cube_dir = cube_dir
+		cube.shape, cube.chunks, cube.dtype = shape, chunks, dtype
+
+		# create every chunk file up front
+		for key in cube.chunk_keys():
+			chunk_shape = tuple(s.stop-s.start for s in cube.chunk_slices(key))
+			np.lib.format.open_memmap(cube.chunk_file(key), mode='w+', dtype=dtype, shape=chunk_shape)
+
+		ct, cy, cx = chunks
+		rows, cols = shape[1:]
+		for t, handle in enumerate(handles):
+			nodata = handle.nodata
+			for y0 in range(0, rows, cy):
+				raw = handle.read(window=(0, y0, cols, min(cy, rows-y0)))
+				band = raw.astype(dtype)
+				if nodata is not None and np.issubdtype(dtype, np.floating):
+					# mask before the cast, in the raster's own dtype
+					band[raw == np.array(nodata).astype(raw.dtype)] = np.nan
+				for x0 in range(0, cols, cx):
+					key = (t//ct, y0//cy, x0//cx)
+					chunk = np.load(cube.chunk_file(key), mmap_mode='r+')
+					chunk[t % ct] = band[:, x0:x0+cx]
+					chunk.flush()
+					del chunk
+			print("Added %s to cube (%i/%i)" %(raster_files[t], t+1, len(handles)))
+
+		with open(os.path.join(cube_dir, INDEX_FILE), 'w') as f:
+			json.dump(index, f, indent=1)
+
+		return cls(cube_dir)
+
+	def chunk_keys(self):
+		''' all (it, iy, ix) chunk indices '''
+		counts = [-(-s//c) for s, c in zip(self.shape, self.chunks)]
+		for it in range(counts[0]):
+			for iy in range(counts[1]):
+				for ix in range(counts[2]):
+					yield (it, iy, ix)
+
+	def chunk_file(self, key):
+		return os.path.join(self.cube_dir, 'c_%i_%i_%i.npy' %key)
+
+	def chunk_slices(self, key):
+		''' (time, row, col) slices of the cube a chunk covers '''
+		return tuple(slice(k*c, min((k+1)*c, s)) for k, c, s in zip(key, self.chunks, self.shape))
+
+	def chunk(self, key):
+		''' memory mapped (read only) chunk array '''
+		return np.load(self.chunk_file(key), mmap_mode='r')
+
+	def read(self, t=slice(None), rows=slice(None), cols=slice(None)):
+		'''
+		Reads a box of the cube - each of t, rows and cols can be an int or a slice. Only
+		the chunks overlapping the box are touched.
+
+		Returns:
+
+		array (axes given as ints are dropped, as with numpy indexing)
+		'''
+		bounds = [_as_slice(i, s) for i, s in zip((t, rows, cols), self.shape)]
+		out = np.empty([b[1]-b[0] for b in bounds], dtype=self.dtype)
+
+		ranges = [range(b[0]//c, -(-b[1]//c)) for b, c in zip(bounds, self.chunks)]
+		for it in ranges[0]:
+			for iy in ranges[1]:
+				for ix in ranges[2]:
+					key = (it, iy, ix)
+					src, dst = [], []
+					for s, b in zip(self.chunk_slices(key), bounds):
+						lo, hi = max(s.start, b[0]), min(s.stop, b[1])
+						src.append(slice(lo-s.start, hi-s.start))
+						dst.append(slice(lo-b[0], hi-b[0]))
+					out[tuple(dst)] = self.chunk(key)[tuple(src)]
+
+		return out[tuple(0 if b[2] else slice(None) for b in bounds)]
+
+	def pixel_series(self, row, col):
+		''' full time series of one pixel '''
+		return self.read(slice(None), row, col)
+
+	def spatial_slice(self, t):
+		''' full (rows, cols) raster for time step t '''
+		return self.read(t, slice(None), slice(None))
+
+	def iter_chunks(self, full_time=True):
+		'''
+		Iterates over the cube one spatial chunk at a time - with full_time=True (default)
+		each block holds every time step for its pixels, which suits per-pixel analyses
+		(e.g. trends) at constant memory.
+
+		Returns:
+
+		generator of ((t_slice, row_slice, col_slice), array) pairs
+		'''
+		if not full_time:
+			for key in self.chunk_keys():
+				yield self.chunk_slices(key), np.asarray(self.chunk(key))
+			return
+
+		for key in self.chunk_keys():
+			if key[0] != 0:
+				continue
+			_, row_slice, col_slice = self.chunk_slices(key)
+			yield (slice(0, self.shape[0]), row_slice, col_slice), self.read(slice(None), row_slice, col_slice)
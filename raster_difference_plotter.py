@@ -7,7 +7,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import matplotlib
-import georaster as geo # https://github.com/atedstone/georaster
+import raster_functions
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import matplotlib.colors as colors
 
@@ -89,8 +89,13 @@ def plot_it(ras1, ras2, contour_min=-800, contour_max=800, unq_nan=-1.6999999999
 
 	##############
 	# read in data
-	ras_1 = geo.SingleBandRaster(ras1)
-	ras_2 = geo.SingleBandRaster(ras2)
+	ras_1 = raster_functions.open_raster_handle(ras1)
+	ras_2 = raster_functions.open_raster_handle(ras2)
+	for ras, ras_file in ((ras_1, ras1), (ras_2, ras2)):
+		if ras is None:
+			sys.exit("Could not open %s \n >>> Exiting difference plotting" %ras_file)
+	ras_1_r = ras_1.read()
+	ras_2_r = ras_2.read()
 
 	#if ras_1.extent!=ras_2.extent:
 	#	sys.exit("Raster extents differ - they must be the same \n >>> Exiting difference plotting")
@@ -98,10 +103,10 @@ def plot_it(ras1, ras2, contour_min=-800, contour_max=800, unq_nan=-1.6999999999
 		
 	##############
 	# calc difference
-	diff=ras_1.r-ras_2.r
+	diff=ras_1_r-ras_2_r
 
-	diff[ras_1.r==np.nan]=np.nan   				# if synth == nan, then diff == nan
-	diff[ras_2.r==np.nan]=np.nan 				# if bed2013 == nan, then diff == nan
+	diff[ras_1_r==np.nan]=np.nan   				# if synth == nan, then diff == nan
+	diff[ras_2_r==np.nan]=np.nan 				# if bed2013 == nan, then diff == nan
 	diff[diff==unq_nan]=np.nan 	# if R no data value (-1.6999999999999999e+308), present then diff == nan
 
 	print(diff)
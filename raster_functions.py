@@ -1,11 +1,16 @@
 from __future__ import division
 import os
 import sys
+import itertools
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from osgeo import gdal, gdalconst, osr
+from osgeo import gdal, gdal_array, gdalconst, osr
 from osgeo.gdalconst import * 
 
 import util
+from geotransform import Affine
 
 import numpy as np
 import pandas as pd
@@ -26,34 +31,175 @@ into python - can then be used as standard numpy matrixes
 @ Chris 2013--onward...
 '''
 
+#############################
+#############################
+## CACHED DATASET HANDLES
+#############################
+#############################
+
+class RasterHandle(object):
+	'''
+	An open (read only) GDAL dataset whose metadata is only worked out the first
+	time it is asked for and then kept.
+
+	Use open_raster_handle() rather than creating these directly so that the same
+	file is only opened once - handles are held in a small LRU cache keyed by path
+	and modification time (i.e. an edited file gets reopened).
+
+	e.g.
+	dem = open_raster_handle('ref_dem.tif')
+	dem.geotransform, dem.nodata, dem.block_size
+	dem_array = dem.read()
+	'''
+
+	def __init__(self, file_name, ds):
+		self.file_name = file_name
+		self.ds = ds
+		self._meta = {}
+
+	def _lazy(self, key, func):
+		if key not in self._meta:
+			self._meta[key] = func()
+		return self._meta[key]
+
+	@property
+	def cols(self):
+		return self.ds.RasterXSize
+
+	@property
+	def rows(self):
+		return self.ds.RasterYSize
+
+	@property
+	def bands(self):
+		return self.ds.RasterCount
+
+	@property
+	def shape(self):
+		''' (rows, cols) '''
+		return (self.rows, self.cols)
+
+	@property
+	def geotransform(self):
+		return self._lazy('geotransform', self.ds.GetGeoTransform)
+
+	@property
+	def projection(self):
+		return self._lazy('projection', self.ds.GetProjection)
+
+	@property
+	def nodata(self):
+		return self._lazy('nodata', self.ds.GetRasterBand(1).GetNoDataValue)
+
+	@property
+	def dtype(self):
+		''' GDAL data type name of band 1 (e.g. 'Float32') '''
+		return self._lazy('dtype', lambda: gdal.GetDataTypeName(self.ds.GetRasterBand(1).DataType))
+
+	@property
+	def block_size(self):
+		''' native (block_xsize, block_ysize) of band 1 '''
+		return self._lazy('block_size', lambda: tuple(self.ds.GetRasterBand(1).GetBlockSize()))
+
+	@property
+	def extent(self):
+		''' (xmin, xmax, ymin, ymax) bounding box of the raster corners '''
+		return self._lazy('extent', lambda: Affine.from_gdal(self.geotransform).bounds(self.cols, self.rows))
+
+	def read(self, band_num=1, window=None, out_shape=None, resampling='nearest'):
+		'''
+		Reads a band (all of it, or a (xoff, yoff, xsize, ysize) window) to an array.
+
+		If out_shape (rows, cols) is given the data is resampled to that size as it is
+		read - see read_decimated
+		'''
+		band = self.ds.GetRasterBand(band_num)
+		if window is None:
+			window = (0, 0, self.cols, self.rows)
+		if out_shape is None:
+			return band.ReadAsArray(*window[:4])
+		return band.ReadAsArray(*window[:4], buf_xsize=out_shape[1], buf_ysize=out_shape[0],
+								resample_alg=RESAMPLING[resampling])
+
+# Resampling methods for decimated reads
+RESAMPLING = {'nearest': gdal.GRIORA_NearestNeighbour, 'bilinear': gdal.GRIORA_Bilinear,
+			  'cubic': gdal.GRIORA_Cubic, 'average': gdal.GRIORA_Average, 'mode': gdal.GRIORA_Mode}
+
+RASTER_CACHE_SIZE = 16 # max number of datasets kept open
+_raster_cache = OrderedDict()
+_raster_cache_lock = threading.Lock()
+
+def open_raster_handle(file_name):
+	'''
+	Returns a RasterHandle for file_name, reusing an already open one if the file
+	hasn't changed since it was opened. Least recently used handles are closed once
+	more than RASTER_CACHE_SIZE are open.
+
+	GDAL datasets can't be shared between threads, so each thread gets its own handle
+	(handles are cached per thread).
+
+	Returns:
+
+	RasterHandle (or None if GDAL can't open the file)
+	'''
+	path = os.path.abspath(file_name)
+	mtime = os.path.getmtime(path) if os.path.exists(path) else None
+	key = (path, mtime, threading.get_ident())
+
+	with _raster_cache_lock:
+		handle = _raster_cache.pop(key, None)
+		if handle is None:
+			# forget any handle to an older version of the file
+			for old_key in [k for k in _raster_cache if k[0] == path and k[1] != mtime]:
+				del _raster_cache[old_key]
+
+			ds = gdal.Open(file_name, GA_ReadOnly)
+			if ds is None:
+				return None
+			handle = RasterHandle(file_name, ds)
+
+		_raster_cache[key] = handle
+		while len(_raster_cache) > RASTER_CACHE_SIZE:
+			_raster_cache.popitem(last=False)
+
+	return handle
+
+def clear_raster_cache():
+	'''
+	Closes all cached datasets
+	'''
+	with _raster_cache_lock:
+		_raster_cache.clear()
+
 # Register driver
 #gdal.AllRegister() #<-- useful only if reading in 
-def openTiff(file_name):
+def openTiff(file_name, band_list=None):
 	'''
 	Converts a geotiff image to a numpy arra.
+
+	By default only band 1 is read (as a 2d array) - pass band_list='all' or a list of
+	band numbers (counting from 1) to get a (bands, rows, cols) array (see read_bands).
 	
 	Returns:
 	
 	image_array, pixelWidth, [geotransform, inDs]
 	'''
 
-	driver = gdal.GetDriverByName('GTiff') ## http://www.gdal.org/formats_list.html
-	driver.Register()
-
-	inDs = gdal.Open(file_name, GA_ReadOnly)
+	handle = open_raster_handle(file_name)
 	
-	if inDs is None:
+	if handle is None:
 		print("Couldn't open this file: " + file_name)
 		sys.exit("Something's missing... can't process file.")
 	else:
 		print("%s opened successfully" %file_name)
+		inDs = handle.ds
 			
 		print('~~~~~~~~~~~~~~')
 		print('Get image size')
 		print('~~~~~~~~~~~~~~')
-		cols = inDs.RasterXSize
-		rows = inDs.RasterYSize
-		bands = inDs.RasterCount
+		cols = handle.cols
+		rows = handle.rows
+		bands = handle.bands
 	
 		print("columns: %i" %cols)
 		print("rows: %i" %rows)
@@ -62,7 +208,7 @@ def openTiff(file_name):
 		print('~~~~~~~~~~~~~~')
 		print('Get georeference information')
 		print('~~~~~~~~~~~~~~')
-		geotransform = inDs.GetGeoTransform()
+		geotransform = handle.geotransform
 		originX = geotransform[0]
 		originY = geotransform[3]
 		pixelWidth = geotransform[1]
@@ -77,8 +223,11 @@ def openTiff(file_name):
 		print('~~~~~~~~~~~~~~' )
 		print('Convert image to 2D array')
 		print('~~~~~~~~~~~~~~')
-		band = inDs.GetRasterBand(1)
-		image_array = band.ReadAsArray(0, 0, cols, rows)
+		if band_list is None:
+			band = inDs.GetRasterBand(1)
+			image_array = band.ReadAsArray(0, 0, cols, rows)
+		else:
+			image_array = read_bands(file_name, band_list)
 		image_array_name = file_name
 		print(type(image_array))
 		print(image_array.shape)
@@ -94,23 +243,21 @@ def tiff_to_2d_array_COMPACT(file_name):
 	[geotransform, inDs, cols, rows, bands, originX, originY, pixelWidth, pixelHeight,image_array_name]
 	'''
 
-	driver = gdal.GetDriverByName('GTiff') ## http://www.gdal.org/formats_list.html
-	driver.Register()
-
-	inDs = gdal.Open(file_name, GA_ReadOnly)
+	handle = open_raster_handle(file_name)
 	
-	if inDs is None:
+	if handle is None:
 		print("Couldn't open this file: " + file_name)
 		sys.exit("Something's missing... can't process file.")
 	else:
 		print("%s opened successfully" %file_name)
+		inDs = handle.ds
 			
 		print('~~~~~~~~~~~~~~')
 		print('Get image size')
 		print('~~~~~~~~~~~~~~')
-		cols = inDs.RasterXSize
-		rows = inDs.RasterYSize
-		bands = inDs.RasterCount
+		cols = handle.cols
+		rows = handle.rows
+		bands = handle.bands
 	
 		print("columns: %i" %cols)
 		print("rows: %i" %rows)
@@ -119,7 +266,7 @@ def tiff_to_2d_array_COMPACT(file_name):
 		print('~~~~~~~~~~~~~~')
 		print('Get georeference information')
 		print('~~~~~~~~~~~~~~')
-		geotransform = inDs.GetGeoTransform()
+		geotransform = handle.geotransform
 		originX = geotransform[0]
 		originY = geotransform[3]
 		pixelWidth = geotransform[1]
@@ -154,24 +301,22 @@ def ENVI_raster_binary_to_2d_array_COMPACT(file_name):
 
 	[geotransform, inDs, cols, rows, bands, originX, originY, pixelWidth, pixelHeight, image_array, image_array_name]
 	'''
-	driver = gdal.GetDriverByName('ENVI') ## http://www.gdal.org/formats_list.html
-	driver.Register()
-
-	inDs = gdal.Open(file_name, GA_ReadOnly)
+	handle = open_raster_handle(file_name)
 	
-	if inDs is None:
+	if handle is None:
 		print("Couldn't open this file: " + file_name)
 		print('\nPerhaps you need an ENVI .hdr file? A quick way to do this is to just open the binary up in ENVI and one will be created for you.')
 		sys.exit("Try again!")
 	else:
 		print("%s opened successfully" %file_name)
+		inDs = handle.ds
 			
 		print('~~~~~~~~~~~~~~')
 		print('Get image size')
 		print('~~~~~~~~~~~~~~')
-		cols = inDs.RasterXSize
-		rows = inDs.RasterYSize
-		bands = inDs.RasterCount
+		cols = handle.cols
+		rows = handle.rows
+		bands = handle.bands
 	
 		print("columns: %i" %cols)
 		print("rows: %i" %rows)
@@ -180,7 +325,7 @@ def ENVI_raster_binary_to_2d_array_COMPACT(file_name):
 		print('~~~~~~~~~~~~~~')
 		print('Get georeference information')
 		print('~~~~~~~~~~~~~~')
-		geotransform = inDs.GetGeoTransform()
+		geotransform = handle.geotransform
 		originX = geotransform[0]
 		originY = geotransform[3]
 		pixelWidth = geotransform[1]
@@ -212,24 +357,22 @@ def ENVI_raster_binary_to_2d_array(file_name):
 
 	geotransform, inDs, cols, rows, bands, originX, originY, pixelWidth, pixelHeight, image_array, image_array_name
 	'''
-	driver = gdal.GetDriverByName('ENVI') ## http://www.gdal.org/formats_list.html
-	driver.Register()
-
-	inDs = gdal.Open(file_name, GA_ReadOnly)
+	handle = open_raster_handle(file_name)
 	
-	if inDs is None:
+	if handle is None:
 		print("Couldn't open this file: " + file_name)
 		print('\nPerhaps you need an ENVI .hdr file? A quick way to do this is to just open the binary up in ENVI and one will be created for you.')
 		sys.exit("Try again!")
 	else:
 		print("%s opened successfully" %file_name)
+		inDs = handle.ds
 			
 		print('~~~~~~~~~~~~~~')
 		print('Get image size')
 		print('~~~~~~~~~~~~~~')
-		cols = inDs.RasterXSize
-		rows = inDs.RasterYSize
-		bands = inDs.RasterCount
+		cols = handle.cols
+		rows = handle.rows
+		bands = handle.bands
 	
 		print("columns: %i" %cols)
 		print("rows: %i" %rows)
@@ -238,7 +381,7 @@ def ENVI_raster_binary_to_2d_array(file_name):
 		print('~~~~~~~~~~~~~~')
 		print('Get georeference information')
 		print('~~~~~~~~~~~~~~')
-		geotransform = inDs.GetGeoTransform()
+		geotransform = handle.geotransform
 		originX = geotransform[0]
 		originY = geotransform[3]
 		pixelWidth = geotransform[1]
@@ -261,17 +404,302 @@ def ENVI_raster_binary_to_2d_array(file_name):
 		
 		return geotransform, inDs, cols, rows, bands, originX, originY, pixelWidth, pixelHeight, image_array, image_array_name
 
-def load_envi(file_name):
+def load_envi(file_name, band_list=None):
 	'''
 	Loads an ENVI binary as a numpy image array also returning a tuple including map and projection info
 
+	By default only band 1 is read - pass band_list='all' or a list of band numbers to 
+	get a (bands, rows, cols) array (see read_bands)
+
 	Returns: 
 
 	image_array, post, (geotransform, inDs)
 	'''
+	if band_list is not None:
+		handle = open_raster_handle(file_name)
+		if handle is None:
+			print("Couldn't open this file: " + file_name)
+			sys.exit("Try again!")
+		return read_bands(file_name, band_list), handle.geotransform[1], (handle.geotransform, handle.ds)
+
 	geotransform, inDs, _, _, _, _, _, post, _, image_array, _ = ENVI_raster_binary_to_2d_array(file_name)
 	return image_array, post, (geotransform, inDs)
 
+def read_bands(file_name, band_list='all', threads=4):
+	'''
+	Reads several bands of a raster into a single (bands, rows, cols) array
+
+	Band interleaved data (e.g. ENVI bsq, most multi-band GeoTIFFs) is read band by band 
+	from a pool of threads, each with its own dataset handle (GDAL handles can't be shared 
+	between threads). Pixel or line interleaved data has to be decoded in full for any one 
+	band, so there all the bands are pulled out in a single pass instead.
+
+	VARIABLES
+
+	file_name 	= path to any GDAL readable raster
+	band_list 	= 'all' (default) or a list of band numbers (counting from 1)
+	threads 	= max number of bands to read at once
+
+	Returns:
+
+	image_array (bands, rows, cols)
+	'''
+	handle = open_raster_handle(file_name)
+	if handle is None:
+		sys.exit("Couldn't open this file: " + file_name)
+
+	if band_list == 'all':
+		band_list = range(1, handle.bands+1)
+	band_list = list(band_list)
+
+	interleave = handle.ds.GetMetadataItem('INTERLEAVE', 'IMAGE_STRUCTURE')
+	if interleave != 'BAND' or len(band_list) == 1 or threads < 2:
+		image_array = handle.ds.ReadAsArray(band_list=band_list)
+		return image_array.reshape(len(band_list), handle.rows, handle.cols)
+
+	dtype = gdal_array.GDALTypeCodeToNumericTypeCode(handle.ds.GetRasterBand(band_list[0]).DataType)
+	image_array = np.empty((len(band_list), handle.rows, handle.cols), dtype=dtype)
+
+	local = threading.local()
+	def read_band(i):
+		if not hasattr(local, 'ds'):
+			local.ds = gdal.Open(file_name, GA_ReadOnly)
+		local.ds.GetRasterBand(band_list[i]).ReadAsArray(buf_obj=image_array[i])
+
+	with ThreadPoolExecutor(max_workers=min(threads, len(band_list))) as pool:
+		list(pool.map(read_band, range(len(band_list))))
+
+	return image_array
+
+# ENVI 'data type' codes to numpy dtypes
+ENVI_DTYPES = {1: np.uint8, 2: np.int16, 3: np.int32, 4: np.float32, 5: np.float64,
+			   6: np.complex64, 9: np.complex128, 12: np.uint16, 13: np.uint32,
+			   14: np.int64, 15: np.uint64}
+
+def envi_header_file(file_name):
+	'''
+	Finds the .hdr belonging to an ENVI binary - either file.bin.hdr or file.hdr
+	'''
+	for hdr_file in (file_name + '.hdr', os.path.splitext(file_name)[0] + '.hdr'):
+		if os.path.isfile(hdr_file):
+			return hdr_file
+	print("Couldn't find an ENVI .hdr file for: " + file_name)
+	print('\nA quick way to make one is to just open the binary up in ENVI and one will be created for you.')
+	sys.exit("Try again!")
+
+def read_envi_header(hdr_file):
+	'''
+	Parses an ENVI .hdr file into a dictionary - keys are lower case, values are
+	strings with {} lists returned as lists of strings
+
+	Returns:
+
+	header (dict)
+	'''
+	with open(hdr_file, 'r') as f:
+		text = f.read()
+
+	if not text.lstrip().startswith('ENVI'):
+		sys.exit("%s is not an ENVI header" %hdr_file)
+
+	header = {}
+	lines = iter(text.splitlines()[1:])
+	for line in lines:
+		if '=' not in line:
+			continue
+		key, value = line.split('=', 1)
+		value = value.strip()
+		# {} values can run over several lines
+		while value.startswith('{') and not value.endswith('}'):
+			value = value + next(lines).strip()
+		if value.startswith('{'):
+			value = [v.strip() for v in value[1:-1].split(',')]
+		header[key.strip().lower()] = value
+
+	return header
+
+def envi_geotransform(header):
+	'''
+	Builds a GDAL style geotransform from the 'map info' of a parsed ENVI header
+	(see read_envi_header) - the reference pixel in map info is 1-based
+
+	Returns:
+
+	geotransform list (or None if the header has no map info)
+	'''
+	if 'map info' not in header:
+		return None
+
+	map_info = header['map info']
+	ref_x, ref_y = float(map_info[1]), float(map_info[2])
+	easting, northing = float(map_info[3]), float(map_info[4])
+	pixelWidth, pixelHeight = float(map_info[5]), float(map_info[6])
+
+	originX = easting - (ref_x-1)*pixelWidth
+	originY = northing + (ref_y-1)*pixelHeight
+
+	return [originX, pixelWidth, 0.0, originY, 0.0, -pixelHeight]
+
+def memmap_envi(file_name, mode='r'):
+	'''
+	Memory maps an ENVI binary - nothing is read from disk until the array is
+	indexed, and then only the pages that are touched. The .hdr is parsed for
+	samples, lines, bands, data type, byte order, interleave, header offset and
+	map info; GDAL is not used.
+
+	The array is always presented as (bands, rows, cols) whatever the interleave
+	(a transposed view, not a copy) - single band files are returned as (rows, cols).
+
+	VARIABLES
+
+	file_name 	= path to ENVI binary (with a .hdr alongside)
+	mode 		= np.memmap mode - 'r' (default), 'r+' to edit in place or 'c' (copy on write)
+
+	Returns:
+
+	image_array, geotransform
+	'''
+	header = read_envi_header(envi_header_file(file_name))
+
+	cols = int(header['samples'])
+	rows = int(header['lines'])
+	bands = int(header.get('bands', 1))
+	offset = int(header.get('header offset', 0))
+	interleave = header.get('interleave', 'bsq').lower()
+
+	dtype = np.dtype(ENVI_DTYPES[int(header['data type'])])
+	dtype = dtype.newbyteorder('>' if int(header.get('byte order', 0)) == 1 else '<')
+
+	if interleave == 'bsq':
+		shape, axes = (bands, rows, cols), (0, 1, 2)
+	elif interleave == 'bil':
+		shape, axes = (rows, bands, cols), (1, 0, 2)
+	elif interleave == 'bip':
+		shape, axes = (rows, cols, bands), (2, 0, 1)
+	else:
+		sys.exit("Unknown ENVI interleave: %s" %interleave)
+
+	image_array = np.memmap(file_name, dtype=dtype, mode=mode, offset=offset, shape=shape).transpose(axes)
+	if bands == 1:
+		image_array = image_array[0]
+
+	return image_array, envi_geotransform(header)
+
+def read_decimated(file_name, out_shape=None, factor=None, band_num=1, resampling='average'):
+	'''
+	Reads a band at reduced resolution (e.g. for plotting or quicklooks) - only the 
+	decimated pixels are decoded rather than reading everything and then slicing. GDAL 
+	reads from the most suitable overview if the file has any (see write_tiff(overviews=True) 
+	or gdaladdo), otherwise it resamples as it reads.
+
+	VARIABLES
+
+	file_name 	= path to any GDAL readable raster
+	out_shape 	= (rows, cols) of the output array
+	factor 		= or, an integer to coarsen by (output has the same shape as array[::factor, ::factor])
+	resampling 	= 'nearest', 'bilinear', 'cubic', 'average' (default) or 'mode'
+
+	Returns:
+
+	image_array, geotransform (of image_array)
+	'''
+	handle = open_raster_handle(file_name)
+	if handle is None:
+		sys.exit("Couldn't open this file: " + file_name)
+
+	if out_shape is None:
+		out_shape = (-(-handle.rows//factor), -(-handle.cols//factor))
+
+	image_array = handle.read(band_num, out_shape=out_shape, resampling=resampling)
+
+	x_scale = handle.cols/out_shape[1]
+	y_scale = handle.rows/out_shape[0]
+	geotransform = (Affine.from_gdal(handle.geotransform)*Affine.scaling(x_scale, y_scale)).to_gdal()
+
+	return image_array, geotransform
+
+#############################
+#############################
+## BLOCK-WISE READING
+#############################
+#############################
+
+# A read window: pixel offsets/sizes of the array that was read (halo included)
+# plus 'core', a (row_slice, col_slice) pair picking the block itself out of that
+# array (i.e. with the halo trimmed off)
+Window = namedtuple('Window', ['xoff', 'yoff', 'xsize', 'ysize', 'core'])
+
+def block_windows(cols, rows, block_xsize, block_ysize, halo=0):
+	'''
+	Generates the read windows that tile a raster of cols x rows in blocks of
+	block_xsize x block_ysize, each grown by 'halo' pixels on every side (clipped
+	to the raster edge).
+
+	Blocks are visited row of blocks by row of blocks (i.e. in the order GDAL
+	stores them on disk)
+
+	Returns:
+
+	generator of Window tuples
+	'''
+	for yoff in range(0, rows, block_ysize):
+		ysize = min(block_ysize, rows-yoff)
+		y0 = max(yoff-halo, 0)
+		y1 = min(yoff+ysize+halo, rows)
+		for xoff in range(0, cols, block_xsize):
+			xsize = min(block_xsize, cols-xoff)
+			x0 = max(xoff-halo, 0)
+			x1 = min(xoff+xsize+halo, cols)
+			core = (slice(yoff-y0, yoff-y0+ysize), slice(xoff-x0, xoff-x0+xsize))
+			yield Window(x0, y0, x1-x0, y1-y0, core)
+
+def iter_blocks(file_name, band_num=1, halo=0, block_size=None, min_rows=256):
+	'''
+	Reads a raster one block at a time rather than pulling the whole band into
+	memory - memory use is set by the block size, not the raster size.
+
+	By default the dataset's native GDAL block size is followed (i.e. whole tiles
+	for a tiled GeoTIFF). Striped rasters (e.g. ENVI binaries or untiled tiffs, which
+	report blocks of a single scanline) are read min_rows scanlines at a time.
+
+	VARIABLES
+
+	file_name 	= path to any GDAL readable raster
+	band_num 	= band to read (default = 1) - None reads every band, as (bands, rows, cols) 
+				  arrays
+	halo 		= number of extra pixels to read around each block (e.g. for filters
+				  that need neighbouring cells) - use window.core to get the block back
+	block_size 	= (block_xsize, block_ysize) to override the native block size
+
+	Returns:
+
+	generator of (window, array) pairs
+
+	e.g.
+	for window, arr in iter_blocks('dem.tif', halo=1):
+		smooth = ndimage.uniform_filter(arr, 3)[window.core]
+	'''
+	handle = open_raster_handle(file_name)
+	if handle is None:
+		sys.exit("Couldn't open this file: " + file_name)
+
+	band = handle.ds.GetRasterBand(1 if band_num is None else band_num)
+	cols, rows = handle.cols, handle.rows
+
+	if block_size is None:
+		block_xsize, block_ysize = band.GetBlockSize()
+		if block_xsize == cols and block_ysize < min_rows:
+			block_ysize = (min_rows//block_ysize)*block_ysize
+	else:
+		block_xsize, block_ysize = block_size
+
+	for window in block_windows(cols, rows, block_xsize, block_ysize, halo):
+		if band_num is None:
+			array = handle.ds.ReadAsArray(window.xoff, window.yoff, window.xsize, window.ysize)
+			yield window, array.reshape((handle.bands, window.ysize, window.xsize))
+		else:
+			yield window, band.ReadAsArray(window.xoff, window.yoff, window.xsize, window.ysize)
+
 # Prerequisite to "ENVI_raster_binary_from_2d_array" if output image is different to original input for which geotransform was set
 def xy_dimensions_Geotransform_update(geotransform, image_in_x_px, image_in_y_px, new_x_px, new_y_px):
 	'''
@@ -311,7 +739,7 @@ def ENVI_raster_binary_from_2d_array(envidata, file_out, post, image_array):
 	bands = 1
 
 	# Creates a new raster data source
-	outDs = driver.Create(file_out, cols, rows, bands, gdal.GDT_Float32)
+	outDs = driver.Create(file_out, cols, rows, bands, gdal_dtype(image_array.dtype))
 	
 	# Write metadata
 	originX = original_geotransform[0]
@@ -347,7 +775,7 @@ def ARC_ASCII_from_2d_array(original_geotransform, inds, file_out, post, image_a
 	rows, cols = image_array.shape
 	bands = 1
 
-	outDs = driver.Create(file_out, cols, rows, bands, 6)
+	outDs = driver.Create(file_out, cols, rows, bands, gdal_dtype(image_array.dtype))
 	
 	# Write metadata
 	originX = original_geotransform[0]
@@ -367,7 +795,292 @@ def ARC_ASCII_from_2d_array(original_geotransform, inds, file_out, post, image_a
 	print("Output binary saved: ", file_out)
 
 
-def tiff_back_from_2d_array(tiffdata, file_out, post, image_array):
+#############################
+#############################
+## OUTPUT DATA TYPES
+#############################
+#############################
+
+def gdal_dtype(dtype):
+	'''
+	GDAL data type matching a numpy dtype - bool (masks) is written as Byte, int8 as 
+	Int16 and float16 as Float32 (GDAL has no equivalents)
+
+	Returns:
+
+	GDAL data type code (e.g. gdal.GDT_Int16)
+	'''
+	dtype = np.dtype(dtype)
+	if dtype == np.bool_:
+		return gdal.GDT_Byte
+	if dtype == np.int8:
+		return gdal.GDT_Int16
+	if dtype == np.float16:
+		return gdal.GDT_Float32
+
+	gdal_type = gdal_array.NumericTypeCodeToGDALTypeCode(dtype)
+	if gdal_type is None:
+		sys.exit("No GDAL data type matches numpy %s" %dtype)
+	return gdal_type
+
+# (lowest, highest, nodata) of the packed integer types - the nodata value is kept 
+# out of the range used for data
+PACKED_RANGES = {'int16': (-32767, 32767, -32768), 'uint16': (0, 65534, 65535)}
+
+def pack_to_int(image_array, dtype='int16', scale=None, offset=None):
+	'''
+	Packs float data into 16 bit integers such that
+
+	value = packed_value * scale + offset
+
+	which is the convention GDAL (and most readers) use for scale/offset metadata. By 
+	default scale and offset stretch the finite data range over the whole integer range. 
+	Either can be fixed instead and the other is fitted so the data range still fits - 
+	e.g. scale=0.1 keeps a DEM to the nearest 10 cm (int16 then covers a 6553 m range, 
+	centred on the data). NaNs become the nodata value.
+
+	A ValueError is raised if the data can't be packed with the given scale/offset 
+	(values are never silently clipped).
+
+	VARIABLES
+
+	image_array = float array to pack
+	dtype 		= 'int16' (default) or 'uint16'
+	scale 		= optional fixed scale
+	offset 		= optional fixed offset
+
+	Returns:
+
+	packed_array, scale, offset, nodata
+	'''
+	qmin, qmax, nodata = PACKED_RANGES[dtype]
+	finite = np.isfinite(image_array)
+
+	if finite.any():
+		vmin = float(image_array[finite].min())
+		vmax = float(image_array[finite].max())
+	else:
+		vmin = vmax = 0.
+
+	if scale is None and offset is None:
+		scale = (vmax-vmin)/(qmax-qmin) if vmax > vmin else 1.
+		offset = vmin - qmin*scale
+	elif offset is None:
+		# centre the data range on the integer range
+		offset = (vmin+vmax)/2. - ((qmin+qmax)/2.)*scale
+	elif scale is None:
+		# smallest scale that gets both ends of the data in range either side of offset
+		scales = []
+		if vmax > offset:
+			scales.append((vmax-offset)/qmax)
+		if vmin < offset:
+			if qmin >= 0:
+				raise ValueError("Data minimum %g is below offset %g - can't pack to %s" %(vmin, offset, dtype))
+			scales.append((vmin-offset)/qmin)
+		scale = max(scales) if scales and max(scales) > 0 else 1.
+
+	packed = np.round((image_array-offset)/scale)
+	if finite.any():
+		pmin, pmax = packed[finite].min(), packed[finite].max()
+		if pmin < qmin or pmax > qmax:
+			raise ValueError("Data range %g to %g doesn't fit in %s with scale %g and offset %g" 
+							 %(vmin, vmax, dtype, scale, offset))
+	packed[~finite] = nodata
+
+	return packed.astype(dtype), scale, offset, nodata
+
+def _set_band_metadata(band, nodata=None, scale=None, offset=None):
+	if nodata is not None:
+		band.SetNoDataValue(nodata)
+	if scale is not None:
+		band.SetScale(scale)
+		band.SetOffset(offset)
+
+#############################
+#############################
+## TILED / COMPRESSED TIFF OUTPUT
+#############################
+#############################
+
+def tiff_creation_options(tiled=False, compress=None, predictor=None, bigtiff=None, blocksize=256, dtype=gdal.GDT_Float32):
+	'''
+	Builds a list of GTiff creation options
+
+	VARIABLES
+
+	tiled 		= write internal tiles of blocksize x blocksize rather than strips
+	compress 	= None (default), 'DEFLATE', 'LZW' or 'ZSTD' (or anything else GTiff accepts)
+	predictor 	= None, 1 (none), 2 (horizontal differencing - integers), 3 (floating point)
+				  or True to choose 2 or 3 from dtype - only used with compress
+	bigtiff 	= None (let GDAL decide), True or False
+	dtype 		= GDAL data type that will be written (only used to choose the predictor)
+
+	Returns:
+
+	list of 'KEY=VALUE' strings
+	'''
+	options = []
+	if tiled:
+		options += ['TILED=YES', 'BLOCKXSIZE=%i' %blocksize, 'BLOCKYSIZE=%i' %blocksize]
+	if compress is not None:
+		options.append('COMPRESS=%s' %compress.upper())
+		if predictor is True:
+			predictor = 3 if dtype in (gdal.GDT_Float32, gdal.GDT_Float64) else 2
+		if predictor:
+			options.append('PREDICTOR=%i' %predictor)
+	if bigtiff is not None:
+		options.append('BIGTIFF=%s' %('YES' if bigtiff else 'NO'))
+	return options
+
+def overview_levels(cols, rows, blocksize=256):
+	'''
+	Decimation factors (2, 4, 8...) needed until the smallest overview fits in one block
+	'''
+	levels = []
+	level = 2
+	while max(cols, rows)/(level/2) > blocksize:
+		levels.append(level)
+		level *= 2
+	return levels
+
+def _set_georeferencing(outDs, geotransform, projection):
+	if geotransform is not None:
+		outDs.SetGeoTransform(list(geotransform))
+	if projection:
+		outDs.SetProjection(projection)
+
+def _copy_with_overviews(srcDs, file_out, creation_options, resampling, blocksize):
+	'''
+	Builds overviews on srcDs and copies it to file_out as a Cloud-Optimized GeoTIFF 
+	(tiles, then overviews stored ahead of the full resolution data)
+	'''
+	srcDs.BuildOverviews(resampling, overview_levels(srcDs.RasterXSize, srcDs.RasterYSize, blocksize))
+	options = [o for o in creation_options if not o.startswith('TILED')] + ['TILED=YES', 'COPY_SRC_OVERVIEWS=YES']
+	outDs = gdal.GetDriverByName('GTiff').CreateCopy(file_out, srcDs, 0, options=options)
+	outDs = None
+
+def write_tiff(file_out, image_array, geotransform=None, projection=None, dtype=None, nodata=None,
+			   pack=None, scale=None, offset=None,
+			   tiled=False, compress=None, predictor=None, bigtiff=None, blocksize=256, 
+			   overviews=False, cog=False, resampling='AVERAGE'):
+	'''
+	Writes a 2d array to a GeoTIFF. By default this is a plain striped, uncompressed tiff; 
+	see tiff_creation_options for tiled/compressed/BigTIFF output. 
+
+	The GDAL data type follows the array's dtype (see gdal_dtype) unless dtype is given. 
+	pack='int16' or 'uint16' stores float data as scaled integers with scale/offset 
+	metadata (see pack_to_int) - a half of the space of Float32. 
+
+	overviews=True adds internal overviews after the data has been written. cog=True writes 
+	a Cloud-Optimized GeoTIFF (tiled, internal overviews, overviews ahead of the data) - this 
+	goes via an in-memory copy of the array.
+
+	e.g. 
+	write_tiff('dem.tif', dem, geotransform, projection, compress='DEFLATE', predictor=True, cog=True)
+
+	Returns:
+
+	NOTHING
+	'''
+	rows, cols = image_array.shape
+
+	if pack is not None:
+		image_array, scale, offset, nodata = pack_to_int(image_array, pack, scale, offset)
+	elif image_array.dtype == np.bool_:
+		image_array = image_array.astype(np.uint8)
+	if dtype is None:
+		dtype = gdal_dtype(image_array.dtype)
+
+	creation_options = tiff_creation_options(tiled or cog, compress, predictor, bigtiff, blocksize, dtype)
+
+	if cog:
+		outDs = gdal.GetDriverByName('MEM').Create('', cols, rows, 1, dtype)
+	else:
+		outDs = gdal.GetDriverByName('GTiff').Create(file_out, cols, rows, 1, dtype, options=creation_options)
+
+	_set_georeferencing(outDs, geotransform, projection)
+	outBand = outDs.GetRasterBand(1)
+	_set_band_metadata(outBand, nodata, scale, offset)
+	outBand.WriteArray(image_array)
+
+	if cog:
+		_copy_with_overviews(outDs, file_out, creation_options, resampling, blocksize)
+	elif overviews:
+		outDs.BuildOverviews(resampling, overview_levels(cols, rows, blocksize))
+
+	outDs = None # flush
+
+def tiff_from_blocks(file_out, blocks, cols, rows, geotransform=None, projection=None, dtype=None, nodata=None,
+					 pack=None, scale=None, offset=None, tiled=True, compress=None, predictor=None, bigtiff=None, blocksize=256, 
+					 overviews=False, cog=False, resampling='AVERAGE', bands=1):
+	'''
+	Writes a GeoTIFF block by block, so the full raster never has to be held in memory.
+
+	blocks is any iterable of (window, array) pairs as produced by iter_blocks() - each 
+	array is written (minus any halo) at its window offset. This means a raster can be 
+	processed and written out at constant memory e.g.
+
+	blocks = ((w, np.where(a < 0, np.nan, a)) for w, a in iter_blocks('dem.tif'))
+	tiff_from_blocks('dem_masked.tif', blocks, cols, rows, geotransform, projection, compress='ZSTD')
+
+	Options are as for write_tiff. Tiled output is the default here. With cog=True the 
+	data is first written to a temporary tiled tiff alongside file_out, which is then 
+	copied (GDAL copies block by block) with its overviews into the final COG layout.
+
+	If dtype isn't given it is taken from the first block. Packing to integers needs scale 
+	and offset to be given, as the data range isn't known until every block has been seen.
+
+	For a multi-band tiff set bands and give each block as a (bands, rows, cols) array 
+	(e.g. from iter_blocks(file_name, band_num=None)).
+
+	Returns:
+
+	NOTHING
+	'''
+	if pack is not None:
+		if scale is None or offset is None:
+			sys.exit("tiff_from_blocks: pack needs scale and offset to be set")
+		nodata = PACKED_RANGES[pack][2]
+		blocks = ((window, pack_to_int(array, pack, scale, offset)[0]) for window, array in blocks)
+	if dtype is None:
+		blocks = iter(blocks)
+		first = next(blocks)
+		dtype = gdal_dtype(first[1].dtype)
+		blocks = itertools.chain([first], blocks)
+
+	creation_options = tiff_creation_options(tiled or cog, compress, predictor, bigtiff, blocksize, dtype)
+	file_tmp = file_out + '.tmp.tif' if cog else file_out
+
+	outDs = gdal.GetDriverByName('GTiff').Create(file_tmp, cols, rows, bands, dtype, options=creation_options)
+	try:
+		_set_georeferencing(outDs, geotransform, projection)
+
+		outBands = [outDs.GetRasterBand(b+1) for b in range(bands)]
+		for outBand in outBands:
+			_set_band_metadata(outBand, nodata, scale, offset)
+		for window, array in blocks:
+			core = window.core
+			if array.dtype == np.bool_:
+				array = array.astype(np.uint8)
+			if bands == 1 and array.ndim == 3:
+				array = array[0]
+			if (array.ndim == 3) != (bands > 1) or (bands > 1 and array.shape[0] != bands):
+				sys.exit("tiff_from_blocks: expected %i band blocks, got an array of shape %s" %(bands, array.shape))
+			for b, outBand in enumerate(outBands):
+				band_array = array[b] if bands > 1 else array
+				outBand.WriteArray(band_array[core], window.xoff+core[1].start, window.yoff+core[0].start)
+
+		if cog:
+			_copy_with_overviews(outDs, file_out, creation_options, resampling, blocksize)
+		elif overviews:
+			outDs.BuildOverviews(resampling, overview_levels(cols, rows, blocksize))
+	finally:
+		outDs = None # flush
+		# the COG's temporary tiff goes whether or not the copy was made
+		if cog and os.path.exists(file_tmp):
+			gdal.GetDriverByName('GTiff').Delete(file_tmp)
+
+def tiff_back_from_2d_array(tiffdata, file_out, post, image_array, **tiff_options):
 	'''
 	Converts a numpy array back to a tiff - requires geotransform and projection 
 	information as imported using ENVI_raster_binary_to_2d_array() or load_ENVI(). If 
@@ -375,34 +1088,22 @@ def tiff_back_from_2d_array(tiffdata, file_out, post, image_array):
 	projection info is specific) then the new posting size must also be passed in to 
 	enable rescaling of pixels accordingly 
 
+	tiff_options are passed on to write_tiff (e.g. compress='DEFLATE', cog=True)
+
 	Returns:
 
 	new_geotransform,new_projection,file_out
 	'''
-	driver = gdal.GetDriverByName('GTIFF') ## Seems to work better if you use the driver that you originally read in 'image_array' with...
-	driver.Register()
-	
 	original_geotransform, inDs = tiffdata
 
-	rows, cols = image_array.shape
-	bands = 1
-
-	# Creates a new raster data source
-	outDs = driver.Create(file_out, cols, rows, bands, gdal.GDT_Float32)
-	
 	# Write metadata
 	originX = original_geotransform[0]
 	originY = original_geotransform[3]
 
-	outDs.SetGeoTransform([originX, post, 0.0, originY, 0.0, -post])
-	outDs.SetProjection(inDs.GetProjection())
+	new_geotransform = (originX, post, 0.0, originY, 0.0, -post)
+	new_projection = inDs.GetProjection()
 
-	#Write raster datasets
-	outBand = outDs.GetRasterBand(1)
-	outBand.WriteArray(image_array)
-	
-	new_geotransform = outDs.GetGeoTransform()
-	new_projection = outDs.GetProjection()
+	write_tiff(file_out, image_array, new_geotransform, new_projection, **tiff_options)
 	
 	print("Output binary saved: ", file_out)
 	
@@ -428,19 +1129,11 @@ def define_geotransform_info(tl_x, tl_y, post, rotation=0):
 	geotransform[3] /* top left y */
 	geotransform[4] /* rotation, 0 if image is "north up" */
 	geotransform[5] /* n-s pixel resolution */
-	'''
 
-	geotransform = np.zeros(6)
-	geotransform[0] = tl_x
-	geotransform[1] = post
-	geotransform[2] = rotation
-	geotransform[3] = tl_y
-	geotransform[4] = rotation
-	geotransform[5] = -post
-
-	geotransform=geotransform.tolist()
+	Use geotransform.Affine.from_origin(...) directly for pixel <-> world conversions
+	'''
 
-	return geotransform
+	return Affine.from_origin(tl_x, tl_y, post, rotation).to_gdal()
 
 
 #def define_projections(test):
@@ -469,7 +1162,7 @@ def tiff_from_array_SET_GEO_INFO(geotransform, file_out, image_array, cols, rows
 	'''
 
 	driver = gdal.GetDriverByName('GTIFF')
-	outRaster = driver.Create(file_out, cols-1, rows-1, 1, GDT_Float32)
+	outRaster = driver.Create(file_out, cols-1, rows-1, 1, gdal_dtype(image_array.dtype))
 	outRaster.SetGeoTransform(geotransform)
 
 	### THIS IS THE BIT I'M STUCK ON!!!
@@ -489,60 +1182,128 @@ def tiff_from_array_SET_GEO_INFO(geotransform, file_out, image_array, cols, rows
 
 	#return new_geotransform,new_projection,file_out
 	
-def tiff_from_array(file_out, image_array, cols, rows):
+def tiff_from_array(file_out, image_array, cols, rows, **tiff_options):
 	'''
 	Creates a tiff from a numpy array
 
+	tiff_options are passed on to write_tiff (e.g. compress='DEFLATE', cog=True)
+
 	Returns:
 
 	NOTHING
 	'''
 
-	driver = gdal.GetDriverByName('GTIFF')
-	outRaster = driver.Create(file_out, cols, rows, 1, GDT_Float32)
-	
-	outband = outRaster.GetRasterBand(1)
-	outband.WriteArray(image_array)
+	write_tiff(file_out, image_array[:rows, :cols], **tiff_options)
 
-	print*("Output tiff created: ", file_out)
+	print("Output tiff created: ", file_out)
 
-def subset_raster_to_extent_of_other(src_filename, match_filename, dst_filename):
-	"""
-	Takes in 2 rasters - one that needs clipping (src_filename) and another (match_filename).
-	You will be clipping src_filename to the extent and post size of match_filename
+# Resampling methods for warping
+WARP_RESAMPLING = {'nearest': gdalconst.GRA_NearestNeighbour, 'bilinear': gdalconst.GRA_Bilinear,
+				   'cubic': gdalconst.GRA_Cubic, 'cubicspline': gdalconst.GRA_CubicSpline,
+				   'lanczos': gdalconst.GRA_Lanczos, 'average': gdalconst.GRA_Average,
+				   'mode': gdalconst.GRA_Mode}
 
-	Also, pass in a path and filename to define where to keep your output.
+def _match_grid(match_filename):
+	"""
+	Projection, geotransform and size of the grid to warp onto
+	"""
+	match_ds = gdal.Open(match_filename, gdalconst.GA_ReadOnly)
+	if match_ds is None:
+		sys.exit("Couldn't open this file: " + match_filename)
+	return match_ds.GetProjection(), match_ds.GetGeoTransform(), match_ds.RasterXSize, match_ds.RasterYSize
 
-	RETURN: nothing
+def _warp_options(resampling='bilinear', warp_memory=None, threads=None):
+	"""
+	Resampling algorithm, memory limit (bytes) and warper options shared by every warp
+	"""
+	options = []
+	if threads is not None:
+		options.append('NUM_THREADS=%s' %('ALL_CPUS' if threads == 'all' else threads))
+	return WARP_RESAMPLING[resampling], (warp_memory or 0.0), options
 
-	Modified from this post: http://stackoverflow.com/questions/10454316/how-to-project-and-resample-a-grid-to-match-another-grid-with-gdal-python
-	@date 24/03/16
+def _warp_to_grid(src_filename, dst_filename, match_grid, warp_options, dtype):
+	"""
+	Warps one source raster onto a grid from _match_grid
 	"""
+	match_proj, match_geotrans, wide, high = match_grid
+	resample_alg, warp_memory, options = warp_options
 
 	# Source
 	src = gdal.Open(src_filename, gdalconst.GA_ReadOnly)
+	if src is None:
+		sys.exit("Couldn't open this file: " + src_filename)
 	src_proj = src.GetProjection()
-	src_geotrans = src.GetGeoTransform()
-
-	# We want a section of source that matches this:
-	match_ds = gdal.Open(match_filename, gdalconst.GA_ReadOnly)
-	match_proj = match_ds.GetProjection()
-	match_geotrans = match_ds.GetGeoTransform()
-	wide = match_ds.RasterXSize
-	high = match_ds.RasterYSize
+	src_nodata = src.GetRasterBand(1).GetNoDataValue()
 
 	# Output / destination
-	dst = gdal.GetDriverByName('GTiff').Create(dst_filename, wide, high, 1, gdalconst.GDT_Float32)
+	dst = gdal.GetDriverByName('GTiff').Create(dst_filename, wide, high, 1, dtype)
 	dst.SetGeoTransform( match_geotrans )
 	dst.SetProjection( match_proj)
 
+	if src_nodata is not None:
+		dst.GetRasterBand(1).SetNoDataValue(src_nodata)
+		options = options + ['INIT_DEST=NO_DATA']
+
 	# Do the work
-	gdal.ReprojectImage(src, dst, src_proj, match_proj, gdalconst.GRA_Bilinear)
+	gdal.ReprojectImage(src, dst, src_proj, match_proj, resample_alg, warp_memory, 0.0, None, None, options)
 
 	del dst # Flush
 
+def subset_raster_to_extent_of_other(src_filename, match_filename, dst_filename, resampling='bilinear', 
+									 warp_memory=None, threads=None, dtype=gdalconst.GDT_Float32):
+	"""
+	Takes in 2 rasters - one that needs clipping (src_filename) and another (match_filename).
+	You will be clipping src_filename to the extent and post size of match_filename
 
-	
+	Also, pass in a path and filename to define where to keep your output.
+
+	VARIABLES
+
+	resampling 	= 'bilinear' (default), 'nearest', 'cubic', 'cubicspline', 'lanczos', 'average' or 'mode'
+	warp_memory = memory (in bytes) the warper may use for each chunk it processes (GDAL's 
+				  default is 64MB) - larger chunks mean fewer passes over the source
+	threads 	= number of threads to warp with, or 'all' (default is single threaded)
+	dtype 		= GDAL data type of the output (default Float32)
+
+	To warp lots of rasters onto the same grid use subset_rasters_to_extent_of_other
+
+	RETURN: nothing
+
+	Modified from this post: http://stackoverflow.com/questions/10454316/how-to-project-and-resample-a-grid-to-match-another-grid-with-gdal-python
+	@date 24/03/16
+	"""
+	_warp_to_grid(src_filename, dst_filename, _match_grid(match_filename), 
+				  _warp_options(resampling, warp_memory, threads), dtype)
+
+def subset_rasters_to_extent_of_other(src_filenames, match_filename, dst_filenames, resampling='bilinear', 
+									  warp_memory=None, threads=None, dtype=gdalconst.GDT_Float32, workers=1):
+	"""
+	As subset_raster_to_extent_of_other but for a list of source rasters (e.g. a series of 
+	epoch DEMs) all warped onto the one match grid. The match grid is read and the warp 
+	options are set up once for the whole batch.
+
+	VARIABLES
+
+	src_filenames = list of rasters to warp
+	dst_filenames = list of output paths (same length as src_filenames)
+	workers 	  = number of rasters to warp at once (each warp can also use 'threads' threads)
+
+	Other variables are as for subset_raster_to_extent_of_other
+
+	RETURN: nothing
+	"""
+	if len(src_filenames) != len(dst_filenames):
+		sys.exit("src_filenames and dst_filenames must be the same length")
+
+	match_grid = _match_grid(match_filename)
+	warp_options = _warp_options(resampling, warp_memory, threads)
+
+	def warp(filenames):
+		_warp_to_grid(filenames[0], filenames[1], match_grid, warp_options, dtype)
+		print("Warped %s to %s" %filenames)
+
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		list(pool.map(warp, zip(src_filenames, dst_filenames)))
 
 def xy_mesh(nx, ny, x_min=0, x_max=1, y_min=0, y_max=1):
 	"""
@@ -586,6 +1347,65 @@ def raster_cell_centres_as_xy(extent, raster_cols, raster_rows, raster_post, plo
 
 	return xv, yv
 
+def cell_centre_axes(geotransform, cols, rows):
+	"""
+	1-D cell centre coordinates of a north up raster - x for each column and y for 
+	each row. Use these (e.g. broadcast as x[None, :], y[:, None]) in place of full 
+	meshgrids.
+
+	RETURN
+		x, y
+	"""
+	aff = Affine.from_gdal(geotransform)
+	x = aff.pixel_to_world(np.arange(cols), 0, centre=True)[0]
+	y = aff.pixel_to_world(0, np.arange(rows), centre=True)[1]
+	return x, y
+
+def iter_xyz(z, geotransform=None, chunk_rows=1024, nodata=None):
+	"""
+	Generates xyz triples (cell centres) for the valid cells of a raster, a chunk 
+	of rows at a time - an alternative to raster_cell_centres_as_xy + xyz_triple that 
+	never builds a coordinate mesh. Coordinates are worked out from the geotransform 
+	(rotation terms included) for just the valid cells in each chunk.
+
+	VARIABLES
+
+	z 				= 2d array (or memmap), or the path to a raster (read chunk by chunk 
+					  with iter_blocks; geotransform and nodata then come from the file)
+	geotransform 	= GDAL style geotransform of z (not needed if z is a path)
+	chunk_rows 		= number of rows per chunk
+	nodata 			= value to skip as well as NaN
+
+	RETURN
+		generator of n x 3 arrays (x, y, z)
+
+	e.g.
+	for xyz in iter_xyz('dem.tif'):
+		...
+	"""
+	if isinstance(z, str):
+		handle = open_raster_handle(z)
+		if handle is None:
+			sys.exit("Couldn't open this file: " + z)
+		geotransform = handle.geotransform
+		if nodata is None:
+			nodata = handle.nodata
+		chunks = ((w.yoff, a) for w, a in iter_blocks(z, block_size=(handle.cols, chunk_rows)))
+	else:
+		chunks = ((r0, z[r0:r0+chunk_rows]) for r0 in range(0, z.shape[0], chunk_rows))
+
+	aff = Affine.from_gdal(geotransform)
+	for r0, zs in chunks:
+		valid = ~np.isnan(zs) if np.issubdtype(zs.dtype, np.floating) else np.ones(zs.shape, dtype=bool)
+		if nodata is not None:
+			valid &= zs != nodata
+		rows, cols = np.nonzero(valid)
+
+		xyz = np.empty((len(rows), 3))
+		xyz[:, 0], xyz[:, 1] = aff.pixel_to_world(cols, rows + r0, centre=True)
+		xyz[:, 2] = zs[rows, cols]
+		yield xyz
+
 def xyz_triple(xv, yv, zv):
 	"""
 	Takes in three grids of the same dimension (e.g. x, y and z) and formats 
@@ -636,31 +1456,64 @@ def xyz_triple_as_pandas_df(numpy_xyz):
 	return xyz_df
 
 
-def xyz_from_grid(x,y,z, pnts_out):
+def xyz_from_grid(x,y,z, pnts_out, fmt=('%.6f', '%.6f', '%.2f'), chunk_size=1000000):
 	"""
 	Takes in three grids of the same dimension (e.g. x, y and z) and 
 	writes out their values as a csv in the format x,y,z. The x and y 
 	grids can be created using raster_cell_centres_as_xy().
 
+	Cells where z is NaN are skipped. The grids are worked through chunk_size 
+	cells at a time - each chunk is masked and formatted in one go and written 
+	with a single (buffered) write.
+
+	If pnts_out ends in .npy or .npz the points are written as binary instead:
+		.npy - an n x 3 float64 array stored column by column (Fortran order), so 
+			   np.load(pnts_out, mmap_mode='r')[:, 2] memory maps the z column
+		.npz - separate x, y and z arrays
+
 	RETURN:
 		nothing
 	"""
-	x_flt=x.flatten()
-	y_flt=y.flatten()[::-1]
-	z_flt=z.flatten()
+	x_flt=x.reshape(-1)
+	y_flt=y.reshape(-1)[::-1]
+	z_flt=z.reshape(-1)
 
 	util.check_output_dir(pnts_out)
-	fout = open(pnts_out, 'w')
-	fout.write("x,y,z\n")
-
 	print("Writing out %i xyz triples to %s" %(len(z_flt),pnts_out))
-	for i in range(0, len(z_flt)):
-		if not np.isnan(z_flt[i]):
-			fout.write("%.6f,%.6f,%.2f\n" %(x_flt[i], y_flt[i], z_flt[i]))
 
-	fout.close()
+	def valid_chunks():
+		for i in range(0, len(z_flt), chunk_size):
+			zs = z_flt[i:i+chunk_size]
+			valid = ~np.isnan(zs)
+			yield x_flt[i:i+chunk_size][valid], y_flt[i:i+chunk_size][valid], zs[valid]
+
+	ext = os.path.splitext(pnts_out)[1].lower()
+
+	if ext == '.npy':
+		n_valid = sum(int(np.count_nonzero(~np.isnan(z_flt[i:i+chunk_size]))) for i in range(0, len(z_flt), chunk_size))
+		xyz = np.lib.format.open_memmap(pnts_out, mode='w+', dtype=np.float64, shape=(n_valid, 3), fortran_order=True)
+		n = 0
+		for xs, ys, zs in valid_chunks():
+			xyz[n:n+len(zs), 0] = xs
+			xyz[n:n+len(zs), 1] = ys
+			xyz[n:n+len(zs), 2] = zs
+			n += len(zs)
+		xyz.flush()
+		del xyz
+
+	elif ext == '.npz':
+		columns = list(zip(*valid_chunks())) or [[], [], []]
+		np.savez(pnts_out, x=np.concatenate(columns[0]), y=np.concatenate(columns[1]), z=np.concatenate(columns[2]))
 
-def tiff_from_2d_array(original_dataset, file_out, post, image_array):
+	else:
+		line = ','.join(fmt) + '\n'
+		with open(pnts_out, 'w', 1 << 20) as fout:
+			fout.write("x,y,z\n")
+			for xs, ys, zs in valid_chunks():
+				values = np.column_stack((xs, ys, zs)).ravel().tolist()
+				fout.write((line*len(zs)) %tuple(values))
+
+def tiff_from_2d_array(original_dataset, file_out, post, image_array, **tiff_options):
 	'''
 	Converts a numpy array back to a tiff.
 
@@ -670,35 +1523,23 @@ def tiff_from_2d_array(original_dataset, file_out, post, image_array):
 	The post variable allwos for resampling of your new array, and modification of a copy of the 
 	geotransform of the exisiting original dataset you pass in.
 
+	tiff_options are passed on to write_tiff (e.g. compress='DEFLATE', cog=True)
+
 	Returns:
 		Nothing
 	
 	'''
-	driver = gdal.GetDriverByName('GTIFF') ## Seems to work better if you use the driver that you originally read in 'image_array' with...
-	driver.Register()
-	
 	inDs = original_dataset
 	original_geotransform = inDs.GetGeoTransform()
 
-	rows, cols = image_array.shape
-	bands = 1
-
-	# Creates a new raster data source
-	outDs = driver.Create(file_out, cols, rows, bands, gdal.GDT_Float32)
-	
 	# Write metadata
 	originX = original_geotransform[0]
 	originY = original_geotransform[3]
 
-	outDs.SetGeoTransform([originX, post, 0.0, originY, 0.0, -post])
-	outDs.SetProjection(inDs.GetProjection())
+	new_geotransform = (originX, post, 0.0, originY, 0.0, -post)
+	new_projection = inDs.GetProjection()
 
-	#Write raster datasets
-	outBand = outDs.GetRasterBand(1)
-	outBand.WriteArray(image_array)
-	
-	new_geotransform = outDs.GetGeoTransform()
-	new_projection = outDs.GetProjection()
+	write_tiff(file_out, image_array, new_geotransform, new_projection, **tiff_options)
 	
 	print("Output binary saved: ", file_out)
 	
@@ -1,10 +1,11 @@
-from __future__ import division
+from __future__ import division, print_function
 
 import sys
 import os
 import time as time # for reading in a timer
 import numpy as np # maths functions (arrays etc.)
 import math
+import itertools
 from matplotlib import pyplot as plt # for ploting
 from scipy import signal # for convolution function
 from scipy import ndimage # for resampling image
@@ -34,12 +35,14 @@ def ARC_ASCII_to_2d_array(file_name):
 	Converts an ArcGIS ASCII raster into an array using GDAL - note that the maximum raster file size is 2MB
 	The default NoData value is -3.40282347e+38  and so this should be dealt with once the array is acquired 
 	(best to use something like: image_array[image_array==image_array.min()] = np.nan)
+
+	For larger grids use read_arc_ascii (no size limit, NoData is set to NaN as it reads)
 	'''
 
-	print "~~~~~~~~~~~ WARNING ~~~~~~~~~~~"
-	print "Arc's default NoData value is -3.40282347e+38  and so this should be dealt with once the array is acquired"
-	print "... best to use something like: image_array[image_array==image_array.min()] = np.nan"
-	print "~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"
+	print("~~~~~~~~~~~ WARNING ~~~~~~~~~~~")
+	print("Arc's default NoData value is -3.40282347e+38  and so this should be dealt with once the array is acquired")
+	print("... best to use something like: image_array[image_array==image_array.min()] = np.nan")
+	print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 	
 	driver = gdal.GetDriverByName('AAIGrid') ## http://www.gdal.org/formats_list.html
 	driver.Register()
@@ -48,52 +51,52 @@ def ARC_ASCII_to_2d_array(file_name):
 	inds = gdal.Open(file_name, GA_ReadOnly)
 	
 	if inds is None:
-		print "Really sorry Sir but I couldn't open this blasted file: " + file_name
-		print '\nPerhaps you need an ENVI .hdr file? If so, just open the binary up in ENVI and one will be created for you!'
+		print("Really sorry Sir but I couldn't open this blasted file: " + file_name)
+		print('\nPerhaps you need an ENVI .hdr file? If so, just open the binary up in ENVI and one will be created for you!')
 		sys.exit("Try again!")
 	else:
-		print "%s opened successfully" %file_name
+		print("%s opened successfully" %file_name)
 			
-		print '~~~~~~~~~~~~~~'
-		print 'Get image size'
-		print '~~~~~~~~~~~~~~'
+		print('~~~~~~~~~~~~~~')
+		print('Get image size')
+		print('~~~~~~~~~~~~~~')
 		cols = inds.RasterXSize
 		rows = inds.RasterYSize
 		bands = inds.RasterCount
 	
-		print "columns: %i" %cols
-		print "rows: %i" %rows
-		print "bands: %i" %bands
+		print("columns: %i" %cols)
+		print("rows: %i" %rows)
+		print("bands: %i" %bands)
 	
-		print '~~~~~~~~~~~~~~'
-		print 'Get georeference information'
-		print '~~~~~~~~~~~~~~'
+		print('~~~~~~~~~~~~~~')
+		print('Get georeference information')
+		print('~~~~~~~~~~~~~~')
 		geotransform = inds.GetGeoTransform()
 		originX = geotransform[0]
 		originY = geotransform[3]
 		pixelWidth = geotransform[1]
 		pixelHeight = geotransform[5]
 	
-		print "origin x: %i" %originX
-		print "origin y: %i" %originY
-		print "width: %2.2f" %pixelWidth
-		print "height: %2.2f" %pixelHeight
+		print("origin x: %i" %originX)
+		print("origin y: %i" %originY)
+		print("width: %2.2f" %pixelWidth)
+		print("height: %2.2f" %pixelHeight)
 	
 		# Set pixel offset.....
-		print '~~~~~~~~~~~~~~' 
-		print 'Convert image to 2D array'
-		print '~~~~~~~~~~~~~~'
+		print('~~~~~~~~~~~~~~')
+		print('Convert image to 2D array')
+		print('~~~~~~~~~~~~~~')
 		band = inds.GetRasterBand(1)
 		image_array = band.ReadAsArray(0, 0, cols, rows)
 		image_array_name = file_name
-		print type(image_array)
-		print shape(image_array)
+		print(type(image_array))
+		print(shape(image_array))
 		
 		return geotransform, inds, cols, rows, bands, originX, originY, pixelWidth, pixelHeight, image_array, image_array_name
 	
 # Prerequisite to "ENVI_raster_binary_from_2d_array" if output image is different to original input for which geotransform was set
 def xy_dimensions_Geotransform_update(geotransform, image_in_x_px, image_in_y_px, new_x_px, new_y_px):
-	print "Updating pixelHeight and Width values"
+	print("Updating pixelHeight and Width values")
 	pixelWidth_original = geotransform[1]
 	pixelHeight_original = geotransform[5]
 	pixel_width_new_image = (image_in_x_px * pixelWidth_original) / new_x_px ## gives pixel size in metres
@@ -108,17 +111,17 @@ def xy_dimensions_Geotransform_update(geotransform, image_in_x_px, image_in_y_px
 def ARC_ASCII_from_2d_array(original_geotransform, post_original, opath, file_out, cols_new_image, rows_new_image, bands, inds, pixel_width_new_image, pixel_height_new_image, image_array):
 
 	if os.path.isdir(opath):
-		print "output_path exists"	
+		print("output_path exists")
 	else:
-		print "output_path DOESN'T exist...\n"
+		print("output_path DOESN'T exist...\n")
 		os.makedirs(opath) 
-		print "...but it does now"
+		print("...but it does now")
 	
 	output_path = "%s/%s" %(opath,file_out)
 	
 	# Creates a new raster data source
 	#outDs = driver.Create(output_path, cols_new_image, rows_new_image, bands, gdal.GDT_Float32)
-	print output_path, cols_new_image, rows_new_image, bands, gdal.GDT_Float32
+	print(output_path, cols_new_image, rows_new_image, bands, gdal.GDT_Float32)
 	outDs = driver.Create(output_path, int(cols_new_image), int(rows_new_image), bands, 6)
 	
 	# Write metadata
@@ -141,10 +144,157 @@ def ARC_ASCII_from_2d_array(original_geotransform, post_original, opath, file_ou
 	new_geotransform = outDs.GetGeoTransform()
 	new_projection = outDs.GetProjection()
 	
-	print "Output binary saved: ", output_path
+	print("Output binary saved: ", output_path)
 	
 	return new_geotransform,new_projection,output_path
 
 
+#############################
+#############################
+## STREAMING ASCII GRID I/O (no GDAL)
+#############################
+#############################
+
+def read_arc_ascii_header(f):
+	'''
+	Reads the ncols/nrows/xllcorner/yllcorner/cellsize/NODATA_value header from an open 
+	ASCII grid. Keys are returned lower case. The header has no fixed length so the first 
+	line of data is also returned (as it has to be read to find the end of the header).
+
+	Returns:
+
+	header (dict), first_data_line
+	'''
+	header = {}
+	for line in f:
+		parts = line.split()
+		if not parts:
+			continue
+		if not parts[0][0].isalpha():
+			return header, line
+		header[parts[0].lower()] = float(parts[1])
+	return header, ''
+
+def arc_ascii_geotransform(header):
+	'''
+	Builds a GDAL style geotransform from an ASCII grid header - the ll values can either 
+	be cell corners (xllcorner) or centres (xllcenter)
+
+	Returns:
+
+	geotransform list
+	'''
+	dx = header.get('dx', header.get('cellsize'))
+	dy = header.get('dy', header.get('cellsize'))
+
+	if 'xllcenter' in header:
+		xll = header['xllcenter'] - dx/2.
+	else:
+		xll = header['xllcorner']
+	if 'yllcenter' in header:
+		yll = header['yllcenter'] - dy/2.
+	else:
+		yll = header['yllcorner']
+
+	return [xll, dx, 0.0, yll + header['nrows']*dy, 0.0, -dy]
+
+def read_arc_ascii(file_name, dtype=np.float32, chunk_rows=1024, memmap_file=None):
+	'''
+	Reads an ArcGIS ASCII grid without GDAL and without a size limit.
+
+	The body is parsed chunk_rows lines at a time straight into a preallocated array 
+	(or, if memmap_file is given, a .npy memmap on disk - so grids bigger than memory 
+	can be read) and NoData values are set to NaN as each chunk is parsed.
+
+	VARIABLES
+
+	file_name 	= path to ASCII grid
+	dtype 		= dtype of output array (default float32)
+	chunk_rows 	= number of text lines parsed at a time
+	memmap_file = optional path of a .npy file to hold the array
+
+	Returns:
+
+	image_array, geotransform, nodata
+	'''
+	with open(file_name, 'r') as f:
+		header, first_line = read_arc_ascii_header(f)
+		cols = int(header['ncols'])
+		rows = int(header['nrows'])
+		nodata = header.get('nodata_value')
+
+		if memmap_file is None:
+			image_array = np.empty((rows, cols), dtype=dtype)
+		else:
+			image_array = np.lib.format.open_memmap(memmap_file, mode='w+', dtype=dtype, shape=(rows, cols))
+		flat = image_array.reshape(-1) # a view - values don't have to line up with text lines
+
+		filled = 0
+		lines = itertools.chain([first_line], f)
+		while True:
+			chunk = list(itertools.islice(lines, chunk_rows))
+			if not chunk:
+				break
+			values = np.fromstring(' '.join(chunk), dtype=np.float64, sep=' ')
+			if filled + values.size > flat.size:
+				sys.exit("%s has more values than ncols x nrows" %file_name)
+			if nodata is not None and np.issubdtype(flat.dtype, np.floating):
+				values[values == nodata] = np.nan
+			flat[filled:filled+values.size] = values
+			filled += values.size
+
+	if filled != flat.size:
+		sys.exit("%s: expected %i values but read %i" %(file_name, flat.size, filled))
+
+	return image_array, arc_ascii_geotransform(header), nodata
+
+def write_arc_ascii(file_out, image_array, geotransform, nodata=-9999, fmt=None, chunk_rows=1024):
+	'''
+	Writes a 2d array (NaNs as nodata) to an ArcGIS ASCII grid without GDAL. 
+	
+	Rows are formatted chunk_rows at a time with a single string format per chunk rather 
+	than value by value. Works on memmaps without loading them.
+
+	VARIABLES
+
+	file_out 		= path of output .asc
+	image_array 	= 2d array (top row = north)
+	geotransform 	= GDAL style geotransform of image_array
+	nodata 			= value written in place of NaN
+	fmt 			= format of each value (default: enough digits to read back exactly - 
+					  '%.9g' for float32, '%.17g' for float64, '%d' for integers)
+
+	Returns:
+
+	NOTHING
+	'''
+	if fmt is None:
+		if np.issubdtype(image_array.dtype, np.integer):
+			fmt = '%d'
+		elif image_array.dtype.itemsize <= 4:
+			fmt = '%.9g'
+		else:
+			fmt = '%.17g'
+	rows, cols = image_array.shape
+	dx = geotransform[1]
+	dy = abs(geotransform[5])
+
+	with open(file_out, 'w') as f:
+		f.write("ncols %i\n" %cols)
+		f.write("nrows %i\n" %rows)
+		f.write("xllcorner %.10g\n" %geotransform[0])
+		f.write("yllcorner %.10g\n" %(geotransform[3] - rows*dy))
+		if dx == dy:
+			f.write("cellsize %.10g\n" %dx)
+		else:
+			f.write("dx %.10g\ndy %.10g\n" %(dx, dy))
+		f.write("NODATA_value %s\n" %(fmt %nodata))
 
+		line_fmt = ' '.join([fmt]*cols) + '\n'
+		for r0 in range(0, rows, chunk_rows):
+			chunk = np.asarray(image_array[r0:r0+chunk_rows])
+			if np.issubdtype(chunk.dtype, np.floating):
+				chunk = np.where(np.isnan(chunk), nodata, chunk)
+			f.write((line_fmt*chunk.shape[0]) %tuple(chunk.ravel().tolist()))
 
+	print("Output ASCII grid saved: ", file_out)
@@ -0,0 +1,129 @@
+'''
+Space-filling curve (Morton / Hilbert) ordering of points
+
+Points that arrive in acquisition order (e.g. ICESat tracks, ship lines) jump all
+over a raster, so block reads and CPU caches keep getting thrown away. Processing them
+in curve order instead keeps consecutive points close together in space - and so in
+the same raster blocks - then the results are put back in the original order.
+
+e.g.
+order = spatial_order(x, y, curve='hilbert')
+values = some_point_function(x[order], y[order])
+values = scatter_back(values, order) 	# back in the original point order
+
+Hilbert order keeps neighbours together better than Morton (no long jumps between
+quadrants) but its keys cost a little more to compute.
+'''
+
+from __future__ import division
+import numpy as np
+
+CURVES = ('morton', 'hilbert')
+
+def quantise(x, y, bits=16, bounds=None):
+	'''
+	Scales coordinates to integers in [0, 2**bits) over bounds (xmin, xmax, ymin, ymax) -
+	default is the extent of the points. Points outside bounds are clamped to the edge
+	and non-finite points go to the far corner.
+
+	Returns:
+
+	ix, iy (uint64 arrays)
+	'''
+	if not 0 < bits <= 32:
+		raise ValueError("bits must be between 1 and 32")
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+	if bounds is None:
+		bounds = (np.nanmin(x), np.nanmax(x), np.nanmin(y), np.nanmax(y))
+	xmin, xmax, ymin, ymax = bounds
+
+	n = 2**bits
+	out = []
+	for v, lo, hi in ((x, xmin, xmax), (y, ymin, ymax)):
+		scale = n/(hi - lo) if hi > lo else 0.
+		q = np.floor((v - lo)*scale)
+		q[~np.isfinite(q)] = n - 1
+		out.append(np.clip(q, 0, n - 1).astype(np.uint64))
+	return out[0], out[1]
+
+def _spread_bits(v):
+	''' puts a 0 bit between each of the (low 32) bits of v '''
+	v = v & np.uint64(0xFFFFFFFF)
+	v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+	v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+	v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+	v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+	v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+	return v
+
+def morton_keys(x, y, bits=16, bounds=None):
+	'''
+	Morton (Z-order) keys - the bits of the quantised x and y interleaved
+
+	Returns:
+
+	uint64 array of keys
+	'''
+	ix, iy = quantise(x, y, bits, bounds)
+	return _spread_bits(ix) | (_spread_bits(iy) << np.uint64(1))
+
+def hilbert_keys(x, y, bits=16, bounds=None):
+	'''
+	Hilbert curve keys (distance along the curve) - vectorised over the points, with
+	one pass per bit
+
+	Returns:
+
+	uint64 array of keys
+	'''
+	ix, iy = quantise(x, y, bits, bounds)
+	n = np.uint64(2**bits)
+	one = np.uint64(1)
+	d = np.zeros(ix.shape, dtype=np.uint64)
+
+	s = n >> one
+	while s > 0:
+		rx = (ix & s) > 0
+		ry = (iy & s) > 0
+		d += s*s*((np.uint64(3)*rx.astype(np.uint64)) ^ ry.astype(np.uint64))
+
+		# rotate the quadrant so the sub-curve is the right way round
+		flip = rx & ~ry
+		ix = np.where(flip, n - one - ix, ix)
+		iy = np.where(flip, n - one - iy, iy)
+		swap = ~ry
+		ix, iy = np.where(swap, iy, ix), np.where(swap, ix, iy)
+		s >>= one
+
+	return d
+
+def spatial_order(x, y, curve='hilbert', bits=16, bounds=None):
+	'''
+	Permutation that sorts points along a space-filling curve ('hilbert' or 'morton')
+
+	Returns:
+
+	integer array - x[order], y[order] are the points in curve order
+	'''
+	if curve == 'hilbert':
+		keys = hilbert_keys(x, y, bits, bounds)
+	elif curve == 'morton':
+		keys = morton_keys(x, y, bits, bounds)
+	else:
+		raise ValueError("curve must be one of %s" %', '.join(CURVES))
+	return np.argsort(keys, kind='stable')
+
+def scatter_back(values, order):
+	'''
+	Puts values computed in spatial order (values[i] belongs to point order[i]) back in
+	the original point order
+
+	Returns:
+
+	array the same shape as values
+	'''
+	values = np.asarray(values)
+	out = np.empty_like(values)
+	out[order] = values
+	return out
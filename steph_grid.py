@@ -5,6 +5,9 @@ Created on Mon Oct 24 19:20:43 2016
 @author: steph
 """
 
+import itertools
+import numpy as np
+
 class Grid:
     
     
@@ -14,8 +17,6 @@ class Grid:
     Initialize with two corners and a mesh spacing, all as n-tuples
     """     
     
-    import numpy as np
-    
     def __init__(self, lo, hi, delta):
         
         if ( (type(lo) != tuple) or (type(hi) != tuple) or  (type(delta) != tuple) ):
@@ -31,6 +32,7 @@ class Grid:
         for l,h,d in zip(lo,hi,delta):    
             self.__slice_centre.append( slice(l+0.5*d,h,d)  )
             self.__slice_node.append( slice(l,h+0.5*d,d)  )   
+        self.__sparse_meshes = dict()
             
     def nodal(self):
         return True
@@ -52,7 +54,7 @@ class Grid:
             
     def axis_x( self, n, nodal ):
         """ 1D array along axis n """
-        return np.mgrid(self.axis_slice(n,nodal))
+        return np.mgrid[self.axis_slice(n,nodal)]
         
     def mesh_slice( self, nodal):
         """ list of slices, mixed nodal and central """
@@ -68,13 +70,58 @@ class Grid:
         
         return slicel
         
-    def mesh(self, nodal):
-        """ mesh of x,y,z,... values """
-        return tuple(np.mgrid[ self.mesh_slice(nodal)])
+    def mesh(self, nodal, sparse=False):
+        """ 
+        mesh of x,y,z,... values 
+        
+        sparse=True gives np.ogrid style open axes instead - one array per axis, 
+        each of length n along its own axis and 1 along the others, which broadcast 
+        against each other like the full mesh (e.g. r = np.sqrt(x**2 + y**2 + z**2)) 
+        without ndim full size arrays. Sparse meshes are memoised per nodal tuple and 
+        are read only.
+        """
+        if not sparse:
+            return tuple(np.mgrid[ self.mesh_slice(nodal)])
+            
+        key = tuple(nodal)
+        if key not in self.__sparse_meshes:
+            axes = np.ogrid[ self.mesh_slice(nodal)]
+            if isinstance(axes, np.ndarray):
+                axes = [axes]
+            for x in axes:
+                x.flags.writeable = False
+            self.__sparse_meshes[key] = tuple(axes)
+        return self.__sparse_meshes[key]
+        
+    def shape(self, nodal):
+        """ number of points along each axis """
+        return tuple(x.size for x in self.mesh(nodal, sparse=True))
+        
+    def iter_blocks(self, nodal, block_shape, sparse=True):
+        """ 
+        iterate over the grid in sub-blocks of (at most) block_shape points, so 
+        large (e.g. 3D ocean / ice column) grids can be evaluated chunk by chunk 
+        at constant memory
+        
+        yields (index, coords) where index is a tuple of slices locating the 
+        block in the full grid (e.g. out[index] = f(*coords)) and coords are 
+        the block's sparse axes (sparse=True, default) or dense meshes
+        """
+        if (type(block_shape) != tuple) or (len(block_shape) != self.__ndim):
+            raise ValueError('block_shape must be a tuple of length {}'.format(self.__ndim))
+            
+        axes = self.mesh(nodal, sparse=True)
+        starts = [range(0, x.size, b) for x, b in zip(axes, block_shape)]
+        for corner in itertools.product(*starts):
+            index = tuple(slice(c, c+b) for c, b in zip(corner, block_shape))
+            coords = tuple(x.reshape(-1)[i].reshape(x.shape[:k] + (-1,) + x.shape[k+1:]) 
+                           for k, (x, i) in enumerate(zip(axes, index)))
+            if not sparse:
+                coords = tuple(np.broadcast_arrays(*coords))
+            yield index, coords
        
 #3D grid exmample
 import matplotlib.pyplot as plt
-import numpy as np
        
 lo = (0.0,0.0,0.0)
 hi = (12.0,6.0,3.0) 
@@ -0,0 +1,103 @@
+import sys
+import os
+import numpy as np
+from geotransform import Affine
+
+# test data
+px=50. # pixel size
+tl_x=-800. # top left x
+tl_y=-250. # top left y
+cols=6
+rows=10
+
+north_up=Affine.from_origin(tl_x, tl_y, px)
+rotated=Affine(tl_x, 40., 30., tl_y, 30., -40.) # 50 m pixels rotated ~37 degrees
+
+
+def test_from_gdal():
+
+	gt=[tl_x, px, 0., tl_y, 0., -px]
+
+	try:
+		assert Affine.from_gdal(gt) == north_up
+		assert north_up.to_gdal() == gt
+		assert north_up.is_north_up and not rotated.is_north_up
+	except AssertionError:
+		sys.exit("Affine from_gdal/to_gdal incorrect")
+
+def test_north_up():
+
+	# cell edges land exactly on pixel boundaries
+	x=tl_x+np.arange(cols)*px
+	y=tl_y-np.arange(cols)*px
+	col, row = north_up.world_to_pixel(x, y)
+	x_c, y_c = north_up.pixel_to_world(0, 0, centre=True)
+
+	try:
+		assert col.tolist() == list(range(cols)) and row.tolist() == list(range(cols))
+		assert (x_c, y_c) == (tl_x+px/2., tl_y-px/2.)
+		assert north_up.inside(np.array([0, cols-1, cols, -1]), np.array([0, rows-1, 0, 0]), cols, rows).tolist() == [True, True, False, False]
+	except AssertionError:
+		sys.exit("Affine north up conversions incorrect")
+
+def test_rotated_round_trip():
+
+	rng=np.random.RandomState(0)
+	col=rng.uniform(-5, 15, 1000)
+	row=rng.uniform(-5, 15, 1000)
+	x, y = rotated.pixel_to_world(col, row)
+	col_back, row_back = rotated.world_to_pixel(x, y, fractional=True)
+	col_i, row_i = rotated.world_to_pixel(*rotated.pixel_to_world(3, 7, centre=True))
+
+	try:
+		assert np.allclose(col_back, col, rtol=0, atol=1e-9)
+		assert np.allclose(row_back, row, rtol=0, atol=1e-9)
+		assert (col_i, row_i) == (3, 7)
+	except AssertionError:
+		sys.exit("Affine rotated round trip incorrect")
+
+def test_inverse():
+
+	try:
+		for aff in (north_up, rotated):
+			assert (~aff*aff).almost_equals(Affine.identity())
+			assert (aff*~aff).almost_equals(Affine.identity())
+	except AssertionError:
+		sys.exit("Affine inverse incorrect")
+
+def test_composition():
+
+	# 4x coarser grid - its pixel (1, 2) starts where the fine grid's pixel (4, 8) does
+	coarse=north_up*Affine.scaling(4)
+	sub=rotated.window_transform(2, 3)
+
+	try:
+		assert coarse.pixel_to_world(1, 2) == north_up.pixel_to_world(4, 8)
+		assert np.allclose(sub.pixel_to_world(1, 1), rotated.pixel_to_world(3, 4))
+	except AssertionError:
+		sys.exit("Affine composition incorrect")
+
+def test_window_and_bounds():
+
+	xmin, xmax, ymin, ymax = north_up.bounds(cols, rows)
+	# a box through the middle of cells (1, 2) to (3, 4) touches columns 1-3, rows 2-4
+	window=north_up.window(tl_x+1.5*px, tl_x+3.5*px, tl_y-4.5*px, tl_y-2.5*px)
+	clipped=north_up.window(tl_x-100*px, tl_x+100*px, tl_y-100*px, tl_y+100*px, cols, rows)
+	off_grid=north_up.window(tl_x+100*px, tl_x+200*px, tl_y-4.5*px, tl_y-2.5*px, cols, rows)
+
+	try:
+		assert (xmin, xmax, ymin, ymax) == (tl_x, tl_x+cols*px, tl_y-rows*px, tl_y)
+		assert window == (1, 2, 3, 3)
+		assert clipped == (0, 0, cols, rows)
+		assert off_grid[2] == 0
+	except AssertionError:
+		sys.exit("Affine window/bounds incorrect")
+
+def test_not_invertible():
+
+	try:
+		Affine(0, 1, 1, 0, 1, 1)
+	except ValueError:
+		pass
+	else:
+		sys.exit("Singular geotransform accepted")
@@ -1,5 +1,6 @@
 import sys
 import os
+import numpy as np
 import grid
 
 # test data
@@ -68,4 +69,54 @@ def test_ll_corner_mesh():
 	try:
 		assert ll_corner[1].max() == (ll_y+(px*ny))
 	except AssertionError:
-		sys.exit("Corner mesh output incorrect")
\ No newline at end of file
+		sys.exit("Corner mesh output incorrect")
+
+def test_world_to_pixel():
+
+	# both grids cover the same area so should agree
+	x=np.array([ll_x+1., ll_x+(px*nx)-1., ll_x+(2.5*px), ll_x-1.])
+	y=np.array([ll_y+(px*ny)-1., ll_y+1., ll_y+(3.5*px), ll_y+1.])
+
+	for g in (ll, grid.grid(ll_x, ll_y+(px*ny), nx, ny, px, corner='top_left')):
+		col, row = g.world_to_pixel(x, y)
+
+		try:
+			assert col.tolist() == [0, nx-1, 2, -1]
+			assert row.tolist() == [0, ny-1, ny-4, ny-1]
+			assert g.inside(col, row).tolist() == [True, True, True, False]
+		except AssertionError:
+			sys.exit("world_to_pixel output incorrect")
+
+def test_pixel_to_world_round_trip():
+
+	col=np.arange(nx)
+	row=np.arange(ny)[::-1]
+	x, y = ll.pixel_to_world(col[:ny], row[:nx])
+
+	try:
+		assert np.array_equal(x, ll.x_axis()[col[:ny]])
+		assert np.array_equal(y, ll.y_axis()[row[:nx]])
+		assert [a.tolist() for a in ll.world_to_pixel(x, y)] == [col[:ny].tolist(), row[:nx].tolist()]
+	except AssertionError:
+		sys.exit("pixel_to_world output incorrect")
+
+def test_axes():
+
+	try:
+		assert len(ll.x_axis()) == nx and len(ll.y_axis()) == ny
+		assert len(ll.x_axis(centre=False)) == nx+1 and len(ll.y_axis(centre=False)) == ny+1
+		assert ll.x_axis()[0] == ll_x+(px/2.)
+		assert ll.y_axis(centre=False)[-1] == ll_y
+	except AssertionError:
+		sys.exit("Axis output incorrect")
+
+def test_mesh_memoised():
+
+	first=tl.cell_centre_mesh()
+	second=tl.cell_centre_mesh()
+
+	try:
+		assert first[0] is second[0] and first[1] is second[1]
+		assert not first[0].flags.writeable
+	except AssertionError:
+		sys.exit("Meshes not memoised")
@@ -0,0 +1,144 @@
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+import point_index_cache
+
+# test data
+rng=np.random.RandomState(42)
+n=5000
+x=rng.uniform(-1000, 1000, n)
+y=rng.uniform(-500, 500, n)
+z=rng.uniform(0, 100, n)
+cell_size=25.
+radius=30.
+
+index=point_index_cache.GridIndex.build(x, y, z, cell_size=cell_size)
+
+
+def write_points(file_name, n_points, seed):
+	r=np.random.RandomState(seed)
+	pd.DataFrame({'x': r.uniform(0, 100, n_points), 'y': r.uniform(0, 100, n_points),
+				  'z': r.uniform(0, 10, n_points)}).to_csv(file_name, index=False)
+
+def test_query_matches_kdtree():
+
+	qx=rng.uniform(-1100, 1100, 20000)
+	qy=rng.uniform(-600, 600, 20000)
+	dists, pos = index.query(qx, qy, radius)
+
+	kd_dists, kd_rows = cKDTree(np.c_[x, y]).query(np.c_[qx, qy], distance_upper_bound=radius)
+	found=np.isfinite(kd_dists)
+
+	try:
+		assert np.array_equal(np.isfinite(dists), found)
+		assert np.allclose(dists[found], kd_dists[found])
+		assert np.array_equal(index.rows[pos[found]], kd_rows[found])
+		assert (pos[~found] == index.n_points).all()
+	except AssertionError:
+		sys.exit("GridIndex query doesn't match cKDTree")
+
+def test_query_on_radius():
+
+	# as with cKDTree's distance_upper_bound, points exactly radius away (along each
+	# axis and on the 3-4-5 diagonal) aren't found, anything closer is
+	px=np.array([radius, 0., -0.6*radius])
+	py=np.array([0., -radius, 0.8*radius])
+	on_radius=point_index_cache.GridIndex.build(px, py, cell_size=cell_size)
+	near=point_index_cache.GridIndex.build([radius-1e-6], [0.], cell_size=cell_size)
+
+	dists, pos = on_radius.query([0.], [0.], radius)
+	kd_dists, kd_rows = cKDTree(np.c_[px, py]).query([[0., 0.]], distance_upper_bound=radius)
+	near_dists, near_pos = near.query([0.], [0.], radius)
+
+	try:
+		assert np.isinf(dists[0]) and pos[0] == on_radius.n_points
+		assert np.isinf(kd_dists[0])
+		assert near_dists[0] == radius-1e-6 and near_pos[0] == 0
+	except AssertionError:
+		sys.exit("GridIndex query wrong at the search radius")
+
+def test_sparse_cells():
+
+	# two clusters far apart - only occupied cells are stored
+	sx=np.r_[rng.uniform(0, 10, 100), rng.uniform(1e6, 1e6+10, 100)]
+	sy=np.r_[rng.uniform(0, 10, 100), rng.uniform(1e6, 1e6+10, 100)]
+	sparse=point_index_cache.GridIndex.build(sx, sy, cell_size=1.)
+	dists, pos = sparse.query([5., 1e6+5, 5e5], [5., 1e6+5, 5e5], 2.)
+
+	try:
+		assert len(sparse.cells) <= 200 and len(sparse.cell_start) == len(sparse.cells)+1
+		assert np.isfinite(dists[:2]).all() and np.isinf(dists[2])
+	except AssertionError:
+		sys.exit("GridIndex sparse cell storage incorrect")
+
+def test_cache_keys():
+
+	cache_dir=tempfile.mkdtemp()
+	try:
+		points_file=os.path.join(cache_dir, 'points.csv')
+		write_points(points_file, 200, 1)
+		cache=point_index_cache.PointIndexCache(os.path.join(cache_dir, 'cache'))
+
+		first=cache.get(points_file, cell_size=10.)
+		second=cache.get(points_file, cell_size=10.)
+		n_same=len(cache.entries())
+		cache.get(points_file, cell_size=20.)
+		n_cell_size=len(cache.entries())
+
+		# a changed file gets a new key, unless keyed on content
+		stat=os.stat(points_file)
+		key=point_index_cache.file_key(points_file, 10.)
+		hash_key=point_index_cache.file_key(points_file, 10., content_hash=True)
+		os.utime(points_file, (stat.st_atime, stat.st_mtime+10))
+
+		try:
+			assert n_same == 1 and n_cell_size == 2
+			assert isinstance(second.x, np.memmap)
+			assert np.array_equal(first.rows, second.rows)
+			assert point_index_cache.file_key(points_file, 10.) != key
+			assert point_index_cache.file_key(points_file, 10., content_hash=True) == hash_key
+		except AssertionError:
+			sys.exit("Index cache keys incorrect")
+	finally:
+		shutil.rmtree(cache_dir, ignore_errors=True)
+
+def test_cache_eviction():
+
+	cache_dir=tempfile.mkdtemp()
+	try:
+		files=[os.path.join(cache_dir, 'points_%i.csv' %i) for i in range(3)]
+		for i, f in enumerate(files):
+			write_points(f, 500, i)
+
+		cache=point_index_cache.PointIndexCache(os.path.join(cache_dir, 'cache'), max_bytes=10**9)
+		for i, f in enumerate(files[:2]):
+			cache.get(f, cell_size=10.)
+			# make the use order explicit (file times can be coarse)
+			os.utime(os.path.join(cache.entries()[-1], point_index_cache.META_FILE), (i, i))
+		oldest, newest = cache.entries()
+		one_index=point_index_cache._dir_size(oldest)
+
+		# room for two indexes - adding a third evicts the least recently used
+		cache.max_bytes=int(2.5*one_index)
+		cache.get(files[2], cell_size=10.)
+		after_third=cache.entries()
+
+		# an index is never evicted to make room for itself
+		cache.max_bytes=0
+		cache.evict(keep=after_third[-1])
+		after_zero=cache.entries()
+
+		cache.clear()
+
+		try:
+			assert len(after_third) == 2 and oldest not in after_third and newest in after_third
+			assert after_zero == after_third[-1:]
+			assert cache.entries() == []
+		except AssertionError:
+			sys.exit("Index cache eviction incorrect")
+	finally:
+		shutil.rmtree(cache_dir, ignore_errors=True)
@@ -0,0 +1,62 @@
+import sys
+import os
+import shutil
+import tempfile
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo') # tiled_gridding writes through raster_functions (GDAL)
+import tiled_gridding
+
+# test data - a 64 x 64 grid of 1 m cells, in 32 x 32 tiles
+px=1.
+cols=64
+rows=64
+tile_size=32
+geotransform=[0., px, 0., float(rows), 0., -px]
+
+
+def grid_one_tile(points):
+
+	spill_dir=tempfile.mkdtemp()
+	try:
+		np.asarray(points, dtype=np.float64).tofile(tiled_gridding.tile_file(spill_dir, 0, 0))
+		window, tile = tiled_gridding.grid_tile(spill_dir, 0, 0, geotransform, cols, rows, tile_size, 0, 'linear')
+	finally:
+		shutil.rmtree(spill_dir, ignore_errors=True)
+	return tile
+
+def test_linear_sparse_tile():
+
+	# two points can't be triangulated
+	tile=grid_one_tile([[5., 60., 1.], [6., 59., 2.]])
+
+	try:
+		assert tile.shape == (tile_size, tile_size)
+		assert np.isnan(tile).all()
+	except AssertionError:
+		sys.exit("Sparse tile not left empty")
+
+def test_linear_collinear_tile():
+
+	# a single straight track across the tile
+	track=[[x, rows-x, x] for x in np.arange(1., 30.)]
+	tile=grid_one_tile(track)
+
+	try:
+		assert tile.shape == (tile_size, tile_size)
+		assert np.isnan(tile).all()
+	except AssertionError:
+		sys.exit("Collinear tile not left empty")
+
+def test_linear_tile():
+
+	# a plane z = x is reproduced inside the points' hull
+	corners=[[0., rows, 0.], [32., rows, 32.], [0., rows-32., 0.], [32., rows-32., 32.]]
+	tile=grid_one_tile(corners)
+	x_centres=np.arange(tile_size)+0.5
+
+	try:
+		assert np.allclose(tile[5, 2:30], x_centres[2:30])
+	except AssertionError:
+		sys.exit("Linear tile incorrect")
@@ -0,0 +1,225 @@
+'''
+Out-of-core gridding of point clouds too large to hold in memory (e.g. multibeam or
+gravity surveys).
+
+1. partition_points_to_tiles - one streaming pass over the point files, appending each
+   point to a binary spill file for every output tile whose extent (plus a halo of
+   neighbouring cells) it falls in
+2. each tile + halo is gridded independently (gridding.py methods) in a pool of processes
+3. the tile cores are written straight into a tiled GeoTIFF as they finish
+
+e.g.
+grid_points_tiled(['survey_1.csv', 'survey_2.csv'], geotransform, cols, rows, 'bathy.tif',
+				  method='linear', tile_size=1024, halo=32, compress='DEFLATE', predictor=True)
+
+Methods: 'mean', 'median', 'min', 'max', 'std', 'count' (binning, see gridding.points_to_avg_grid),
+'linear' (Delaunay, see gridding.TriangulationInterpolator) and 'idw', 'nearest', 'knn_mean'
+(KD-tree, see gridding.NeighbourInterpolator - keep the search radius within the halo)
+'''
+
+from __future__ import division, print_function
+import os
+import sys
+import glob
+import itertools
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from scipy.spatial import QhullError
+
+import gridding
+import raster_functions
+from geotransform import Affine
+
+BINNING_METHODS = ('mean', 'median', 'min', 'max', 'std', 'count')
+
+def tile_file(spill_dir, ty, tx):
+	return os.path.join(spill_dir, 'tile_%i_%i.bin' %(ty, tx))
+
+def partition_points_to_tiles(points, geotransform, cols, rows, spill_dir, tile_size=1024, halo=16,
+							  chunksize=1000000, sep=',', columns=('x', 'y', 'z')):
+	'''
+	Splits points into per-tile spill files (raw float64 x, y, z triples) in a single
+	streaming pass. A point within 'halo' cells of a tile edge is also written to the
+	neighbouring tile(s), so tiles can be gridded independently without edge effects.
+
+	VARIABLES
+
+	points 			= csv path, list of csv paths, or anything gridding.iter_point_chunks takes
+	geotransform 	= GDAL style (north up) geotransform of the output grid
+	cols, rows 		= output grid size
+	spill_dir 		= directory for the spill files (tile_<row>_<col>.bin)
+	tile_size 		= tile size in cells
+	halo 			= halo width in cells (must be less than tile_size)
+
+	Returns:
+
+	number of tile rows, number of tile cols
+	'''
+	if halo >= tile_size:
+		sys.exit("halo must be smaller than tile_size")
+	if not os.path.isdir(spill_dir):
+		os.makedirs(spill_dir)
+	# points are appended to the spill files, so clear out any from an earlier run
+	for old_file in glob.glob(os.path.join(spill_dir, 'tile_*_*.bin')):
+		os.remove(old_file)
+
+	aff = Affine.from_gdal(geotransform)
+	n_ty = -(-rows//tile_size)
+	n_tx = -(-cols//tile_size)
+
+	if isinstance(points, (list, tuple)):
+		sources = points
+	else:
+		sources = [points]
+
+	n_points = 0
+	for source in sources:
+		for xyz in gridding.iter_point_chunks(source, chunksize, sep, columns):
+			col, row = aff.world_to_pixel(xyz[:, 0], xyz[:, 1], fractional=True)
+
+			# a point can sit in the halo of at most one neighbour along each axis
+			tile_ids, point_ids = [], []
+			for dy in (0, 1):
+				ty = np.floor((row - halo)/tile_size) + dy
+				ty_ok = (ty >= 0) & (ty < n_ty) & (ty <= np.floor((row + halo)/tile_size))
+				for dx in (0, 1):
+					tx = np.floor((col - halo)/tile_size) + dx
+					ok = ty_ok & (tx >= 0) & (tx < n_tx) & (tx <= np.floor((col + halo)/tile_size))
+					ok &= np.isfinite(xyz[:, 2])
+					idx = np.nonzero(ok)[0]
+					tile_ids.append((ty[idx]*n_tx + tx[idx]).astype(np.int64))
+					point_ids.append(idx)
+
+			tile_ids = np.concatenate(tile_ids)
+			point_ids = np.concatenate(point_ids)
+			order = np.argsort(tile_ids, kind='stable')
+			tile_ids, point_ids = tile_ids[order], point_ids[order]
+
+			tiles, starts = np.unique(tile_ids, return_index=True)
+			ends = np.append(starts[1:], len(tile_ids))
+			for tile, start, end in zip(tiles, starts, ends):
+				with open(tile_file(spill_dir, tile//n_tx, tile % n_tx), 'ab') as f:
+					xyz[point_ids[start:end]].tofile(f)
+
+			n_points += len(xyz)
+
+	print("Partitioned %i points into %i x %i tiles" %(n_points, n_ty, n_tx))
+
+	return n_ty, n_tx
+
+def grid_tile(spill_dir, ty, tx, geotransform, cols, rows, tile_size, halo, method, method_options=None):
+	'''
+	Grids one tile (plus halo) from its spill file and crops it back to the tile.
+
+	Returns:
+
+	raster_functions.Window of the tile, float32 array
+	'''
+	aff = Affine.from_gdal(geotransform)
+
+	# haloed tile extent, clipped to the grid
+	x0, y0 = max(tx*tile_size - halo, 0), max(ty*tile_size - halo, 0)
+	x1, y1 = min((tx+1)*tile_size + halo, cols), min((ty+1)*tile_size + halo, rows)
+	core = (slice(ty*tile_size - y0, min((ty+1)*tile_size, rows) - y0),
+			slice(tx*tile_size - x0, min((tx+1)*tile_size, cols) - x0))
+	window = raster_functions.Window(x0, y0, x1-x0, y1-y0, core)
+	tile_aff = aff.window_transform(x0, y0)
+	tile_gt = tile_aff.to_gdal()
+
+	spill = tile_file(spill_dir, ty, tx)
+	if not os.path.isfile(spill):
+		fill = 0 if method == 'count' else np.nan
+		return window, np.full((y1-y0, x1-x0), fill, dtype=np.float32)
+	xyz = np.fromfile(spill, dtype=np.float64).reshape(-1, 3)
+
+	if method in BINNING_METHODS:
+		grids = gridding.points_to_avg_grid(xyz, tile_gt, x1-x0, y1-y0, median=(method == 'median'))
+		tile = grids[method]
+	elif method == 'linear':
+		xi = tile_aff.pixel_to_world(np.arange(x1-x0), 0, centre=True)[0]
+		yi = tile_aff.pixel_to_world(0, np.arange(y1-y0), centre=True)[1]
+		# too few or collinear points (e.g. one ship track clipping the tile) can't be
+		# triangulated - leave the tile empty rather than failing the whole run
+		tile = np.full((y1-y0, x1-x0), np.nan)
+		if len(xyz) >= 3:
+			try:
+				tile = gridding.TriangulationInterpolator(xyz[:, 0], xyz[:, 1]).set_targets(xi, yi)(xyz[:, 2])
+			except QhullError:
+				pass
+	elif method in gridding.NEIGHBOUR_METHODS:
+		interp = gridding.NeighbourInterpolator(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+		tile = interp.grid(tile_gt, x1-x0, y1-y0, method=method, **(method_options or {}))
+	else:
+		raise ValueError("Unknown gridding method: %s" %method)
+
+	return window, tile.astype(np.float32)
+
+def _grid_tiles(pool, spill_dir, n_ty, n_tx, geotransform, cols, rows, tile_size, halo, method, method_options, workers):
+	'''
+	Grids every tile in the pool, yielding (window, array) as each finishes. Only a few 
+	tiles per worker are in flight at once and each finished tile is dropped once it has 
+	been yielded (written), so memory use doesn't grow with the size of the output grid.
+	'''
+	tiles = ((ty, tx) for ty in range(n_ty) for tx in range(n_tx))
+	max_pending = 2*(workers or os.cpu_count() or 1)
+	pending = set()
+	n_done = 0
+
+	while True:
+		for ty, tx in itertools.islice(tiles, max_pending - len(pending)):
+			pending.add(pool.submit(grid_tile, spill_dir, ty, tx, geotransform, cols, rows, tile_size, halo,
+									method, method_options))
+		if not pending:
+			return
+		done, pending = wait(pending, return_when=FIRST_COMPLETED)
+		while done:
+			yield done.pop().result()
+			n_done += 1
+			print("Gridded tile %i/%i" %(n_done, n_ty*n_tx))
+
+def grid_points_tiled(points, geotransform, cols, rows, file_out, method='mean', tile_size=1024, halo=16,
+					  spill_dir=None, workers=None, projection=None, method_options=None, chunksize=1000000,
+					  sep=',', columns=('x', 'y', 'z'), **tiff_options):
+	'''
+	Grids a point cloud larger than memory to a tiled GeoTIFF - see module docstring.
+
+	VARIABLES
+
+	points 			= csv path or list of csv paths (or anything partition_points_to_tiles takes)
+	geotransform 	= GDAL style (north up) geotransform of the output grid
+	cols, rows 		= output grid size
+	file_out 		= output GeoTIFF
+	method 			= gridding method (see module docstring)
+	tile_size 		= tile size in cells
+	halo 			= cells of neighbouring points each tile sees beyond its edge
+	spill_dir 		= where to put the spill files (default: a temporary directory, removed
+					  afterwards - a given spill_dir is left in place)
+	workers 		= number of processes (default: number of CPUs)
+	projection 		= WKT projection of the output
+	method_options 	= dict of options for the KD-tree methods e.g. {'k': 12, 'radius': 300.}
+	tiff_options 	= passed on to raster_functions.tiff_from_blocks (e.g. compress='DEFLATE')
+
+	Returns:
+
+	NOTHING
+	'''
+	temp_spill = spill_dir is None
+	if temp_spill:
+		spill_dir = tempfile.mkdtemp(prefix='tiled_gridding_')
+
+	try:
+		n_ty, n_tx = partition_points_to_tiles(points, geotransform, cols, rows, spill_dir, tile_size, halo,
+											   chunksize, sep, columns)
+
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			raster_functions.tiff_from_blocks(file_out, _grid_tiles(pool, spill_dir, n_ty, n_tx, geotransform, cols, rows,
+																	tile_size, halo, method, method_options, workers),
+											  cols, rows, geotransform, projection, **tiff_options)
+	finally:
+		if temp_spill:
+			shutil.rmtree(spill_dir, ignore_errors=True)
+
+	print("Output grid saved: ", file_out)